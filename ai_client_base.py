@@ -2,6 +2,7 @@
 from dataclasses import dataclass, field, asdict
 import datetime
 from PIL import Image
+import cv2
 import os
 import re
 
@@ -16,21 +17,24 @@ class AiClientBase:
         self.env = env
         self.image_counter = 0
         self.is_first_response = True
-        self.border_points = Mapping().generate_border_points(NaviConfig.border_size)
+        self.map = Mapping()
+        self.border_points = self.map.generate_border_points(NaviConfig.border_size)
         self.obstacle_points = NaviConfig.obstacles.values()
 
-    def initial_prompt(self, curr_state):
+    def initial_prompt(self, curr_state=None):
+        # Without a state the prompt is static; the state then follows in a separate 'State' message
+        state = f"Current state is {curr_state}." if curr_state is not None else "Your current state is given in the 'State' section."
         return (f"""
         You are Go2, a robot dog assistant. You can only speak English regardless of the language the user uses. Your position and orientation are represented by a state (x, y, orientation), where:
 
         - x and y are grid coordinates representing your position.
         - orientation is the facing direction in degrees.
 
-        Your task is to search for the target object, {self.env['target']}. Current state is {curr_state}. You can only see objects in your facing direction and must adjust your orientation to face the target while searching.
+        Your task is to search for the target object, {self.env['target']}. {state} You can only see objects in your facing direction and must adjust your orientation to face the target while searching.
         """)
     
     def get_action_dictionary(self):
-        return ("""
+        return (f"""
         Action dictionary:
         - 'move forward'
         - 'move backward'
@@ -44,14 +48,8 @@ class AiClientBase:
         """)
     
     def get_new_state(self):
-        return ("""
-        Obstacles:
-        You should avoid the following obstacles:
-        {self.get_obstacles()}
-
-        Allowed Coordinates:
-        You can navigate to the following coordinates:
-        {self.list_inner_coordinates()}
+        return (f"""
+        {self.describe_map(self.env.get('map_encoding_auto', 'rle'))}
         
         Orientation determines all directional movements. Use the following orientation mappings:
         - 0° or 360° (North): Facing the positive Y-axis.
@@ -83,6 +81,27 @@ class AiClientBase:
         - Confirm each x or y coordinate change reflects the intended movement or shift by double-checking against the table above to ensure consistency with the specified orientation.
         """)
     
+    def describe_map(self, encoding):
+        """
+        The obstacles and navigable cells in one of the map encodings:
+        - list: every obstacle/border point and every allowed coordinate as (x, y)
+        - grid: an ASCII occupancy grid, one line per row
+        - rle: the free x ranges of each row
+        """
+        if encoding == "grid":
+            return self.map.occupancy_grid()
+        if encoding == "rle":
+            return self.map.run_length_rows()
+        if encoding != "list":
+            raise ValueError(f"Unknown map encoding {encoding}; choose one of list, grid, rle")
+        return (f"""Obstacles:
+        You should avoid the following obstacles:
+        {self.get_obstacles()}
+
+        Allowed Coordinates:
+        You can navigate to the following coordinates:
+        {self.list_inner_coordinates()}""")
+
     def get_landmarks(self):
         landmarks_str = ",\n".join([f'"{name}": {coords}' for name, coords in NaviConfig.landmarks.items()])
         return f"Landmarks:\n{landmarks_str}\n"
@@ -100,7 +119,7 @@ class AiClientBase:
         border_size = NaviConfig.border_size
 
         # Get the obstacle coordinates
-        obstacle_coords = set(self.obstacle_points)
+        obstacle_coords = {(coords[0], coords[1]) for coords in self.obstacle_points}
 
         # List all coordinates within the border, excluding obstacles
         inner_coords = [
@@ -115,7 +134,7 @@ class AiClientBase:
         # Return the prompt with the allowed coordinates
         return f"""{inner_coords_str}"""
 
-    def prompt_auto(self, curr_state):
+    def prompt_auto(self, curr_state=None):
         stop_target = self.env.get('stop_target')
         threshold_range = self.env.get('threshold_range')
 
@@ -180,6 +199,20 @@ class AiClientBase:
                 - Rotate once to explore a different orientation without changing your position (x, y). If the previous round involved turning right once, do not turn left this round, and vice versa.
         """)
 
+    def reason_rules(self):
+        """The Reason bullets, shared by the auto-search format and the policy engine's reason request."""
+        rules = [
+            f"If none of {self.env['object2']}, {self.env['object3']}, {self.env['object4']}, {self.env['object5']}, {self.env['object6']}, or {self.env['object7']} are detected, don't mention them. Instead, say something like, 'I looked around, but I don't see {self.env['target']}, so I'll turn to look in a different direction.",
+            f"If {self.env['object2']} or {self.env['object3']} is found, this is a kitchen and mention it while making an everyday contextual association with {self.env['target']}.",
+            f"If {self.env['object4']} and {self.env['object5']} are found, there might be more food around in the living room.",
+            f"If {self.env['object6']} is found, it seems like an office space, and {self.env['target']} wouldn't typically be here.",
+            f"If {self.env['object7']} is found, it suggests this is a living room, not the kind of place where you'd expect to find {self.env['target']}.",
+            "Explain your reasoning concisely within two sentences.",
+            "Do not mention case numbers, subcase numbers, section names or distances.",
+            f"If referring to the {self.env['target']} position in the image, use 'left', 'middle', or 'right' without mentioning 'third'.",
+        ]
+        return "\n".join(f"          - {rule}" for rule in rules)
+
     def response_format_auto(self):
         return (f"""
         Ensure each response follows the following format precisely. Do not deviate. Before responding, verify that your output exactly matches the structured format.
@@ -189,14 +222,16 @@ class AiClientBase:
         - **New State**: (x, y, orientation)
         - **Action**: action1, action2, ...
         - **Reason**: 
-          - If none of {self.env['object2']}, {self.env['object3']}, {self.env['object4']}, {self.env['object5']}, {self.env['object6']}, or {self.env['object7']} are detected, don't mention them. Instead, say something like, 'I looked around, but I don't see {self.env['target']}, so I'll turn to look in a different direction.
-          - If {self.env['object2']} or {self.env['object3']} is found, this is a kitchen and mention it while making an everyday contextual association with {self.env['target']}.
-          - If {self.env['object4']} and {self.env['object5']} are found, there might be more food around in the living room.
-          - If {self.env['object6']} is found, it seems like an office space, and {self.env['target']} wouldn't typically be here.
-          - If {self.env['object7']} is found, it suggests this is a living room, not the kind of place where you'd expect to find {self.env['target']}.
-          - Explain your reasoning concisely within two sentences.
-          - Do not mention case numbers, subcase numbers, section names or distances.
-          - If referring to the {self.env['target']} position in the image, use 'left', 'middle', or 'right' without mentioning 'third'.
+{self.reason_rules()}
+        """)
+
+    def response_format_reason(self, action):
+        return (f"""
+        You already decided to {", then ".join(action)}. Do not change the action; only explain it.
+
+        Response Format:
+        - Respond only with the reason, without a heading or extra text.
+{self.reason_rules()}
         """)
 
     def prompt_landmark_or_non_command(self, curr_state):
@@ -210,7 +245,7 @@ class AiClientBase:
         - Current state: {curr_state}
 
         {self.get_landmarks()}\n\n
-        {self.get_obstacles()}
+        {self.get_obstacles() if self.env.get('map_encoding_feedback', 'list') == 'list' else self.describe_map(self.env['map_encoding_feedback'])}
         """)
 
     def response_format_landmark_command(self): # landmark command: go close to the fridge
@@ -256,6 +291,38 @@ class AiClientBase:
           - Explain your choice of actions in one concise sentence.
         """)
 
+    def construct_detection_auto(self, description):
+        return (
+            f"Detection:\n"
+            f"(The image size is {self.env['captured_width']}x{self.env['captured_height']}, "
+            f"with the pixel index (0, 0) located at the top-left corner.)\n"
+            f"{description} \n\n"
+        )
+
+    def construct_state(self, curr_state):
+        return (
+            f"State:\n"
+            f"Current state is {curr_state}.\n\n"
+        )
+
+    def construct_memory(self, memory):
+        return (
+            f"Memory:\n {memory if memory else 'None'}\n\n"
+        )
+
+    def render_prompt_auto_prefix(self):
+        """Everything of the auto-search prompt that depends only on env and NaviConfig."""
+        return [self.prompt_auto(), self.response_format_auto()]
+
+    def auto_messages(self, prefix, curr_state, description, memory):
+        """The auto-search prompt: the static prefix first, the volatile parts last, so only the tail differs between rounds."""
+        return [
+            *prefix,
+            self.construct_memory(memory),
+            self.construct_state(curr_state),
+            self.construct_detection_auto(description),
+        ]
+
     def set_target(self, target):
         self.target = target
 
@@ -263,20 +330,20 @@ class AiClientBase:
         return None
 
     def store_image(self, image_array = None):
-        if image_array is None:
-            text = "The user provided feedback; no image was captured."
-            image = Image.new('RGB', (self.env["captured_width"], self.env["captured_height"]), 'black')
-            image = utils.put_text_in_the_middle(image, text, self.env["captured_width"], self.env["captured_height"])
-        else:
-            image = utils.OpenCV2PIL(image_array)
- 
+        """Save a BGR frame (e.g. VisionResponse.frame), or a placeholder when no image was captured."""
         # Format the filename based on the number of images stored
         self.image_counter += 1
         filename = f"image{self.image_counter:02d}.jpg"  # Pad with zeros to two digits
         image_path = os.path.join(self.save_dir, filename)
 
-        # Save the image
-        image.save(image_path)
+        if image_array is None:
+            text = "The user provided feedback; no image was captured."
+            image = Image.new('RGB', (self.env["captured_width"], self.env["captured_height"]), 'black')
+            image = utils.put_text_middle(image, text, self.env["captured_width"], self.env["captured_height"])
+            image.save(image_path)
+        else:
+            # The frame is already BGR, so OpenCV writes it without a colour conversion
+            cv2.imwrite(image_path, image_array)
         # print(f"Image saved to {image_path}")
 
     def close(self):
@@ -290,6 +357,7 @@ class ResponseMsg:
     new_state: tuple
     action: list
     reason: str
+    reason_future: "concurrent.futures.Future" = field(default=None, repr=False, compare=False)  # set when the reason is still being written (decision_engine: policy)
 
     @staticmethod
     def parse(message: str):
@@ -317,4 +385,59 @@ class ResponseMsg:
                 reason="Parse error"
             )
         return ResponseMsg(initial_state, new_state, actions, reason)
-        
\ No newline at end of file
+        
+
+class ResponseStreamParser:
+    """
+    Incremental ResponseMsg.parse for a streamed reply.
+
+    Each field is parsed as soon as its line is complete, so the action is known (and `on_action` is
+    called) while the reason is still being generated.
+    """
+    def __init__(self, on_action=None):
+        self.on_action = on_action
+        self.text = ""
+        self.buffer = ""
+        self.parts = []
+
+    def feed(self, text):
+        self.text += text
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split('\n')
+        for line in lines:
+            self.add_line(line)
+
+    def close(self):
+        if self.buffer:
+            self.add_line(self.buffer)
+            self.buffer = ""
+
+    def add_line(self, line):
+        if len(self.parts) >= 4:
+            # The reason may continue, or only start, on the lines after 'Reason:'
+            text = line.strip().lstrip("-* ").strip()
+            if text:
+                self.parts[3] = f"{self.parts[3]} {text}".strip()
+            return
+        # Same rule as ResponseMsg.parse: the first four lines containing ':' are the four fields
+        if ':' not in line or not line.strip():
+            return
+        self.parts.append(line.split(":", 1)[1].strip())
+        if len(self.parts) == 3 and self.on_action is not None:
+            self.on_action(self)
+
+    @property
+    def has_action(self):
+        return len(self.parts) >= 3
+
+    @property
+    def reason(self):
+        return self.parts[3] if len(self.parts) > 3 else ""
+
+    def response(self):
+        """ResponseMsg from the fields parsed so far; raises ValueError before the action line."""
+        if not self.has_action:
+            raise ValueError("Action line not received yet")
+        initial_state = utils.string_to_tuple(self.parts[0])
+        new_state = utils.string_to_tuple(self.parts[1])
+        return ResponseMsg(initial_state, new_state, utils.string_to_list(self.parts[2]), self.reason)
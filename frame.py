@@ -0,0 +1,97 @@
+# frame.py
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+class Frame:
+    """
+    One captured image backed by a single numpy buffer, with lazily cached views.
+
+    The camera delivers BGR, vision models want RGB/PIL, the tracker and frame cache want grayscale
+    and the UI wants a QImage. Each view is computed at most once per frame and shared by every
+    consumer, instead of every consumer converting its own full-resolution copy. Views are read-only
+    by convention: copy before drawing on one.
+    """
+    def __init__(self, array, order="bgr", seq=None, timestamp=None):
+        if order not in ("bgr", "rgb"):
+            raise ValueError(f"Unsupported channel order {order}")
+        self.views = {order: array}
+        self.seq = seq
+        self.timestamp = timestamp  # time.monotonic() at capture, when it came from a frame source
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_pil(cls, image_pil):
+        if image_pil.mode != "RGB":
+            image_pil = image_pil.convert("RGB")
+        frame = cls(np.asarray(image_pil), order="rgb")
+        frame.views["pil"] = image_pil
+        return frame
+
+    @property
+    def width(self):
+        return self.array.shape[1]
+
+    @property
+    def height(self):
+        return self.array.shape[0]
+
+    @property
+    def size(self):
+        """(width, height), like PIL.Image.size."""
+        return self.width, self.height
+
+    @property
+    def array(self):
+        return self.views.get("bgr", self.views.get("rgb"))
+
+    def view(self, name, make):
+        view = self.views.get(name)
+        if view is None:
+            with self.lock:
+                view = self.views.get(name)
+                if view is None:
+                    view = make()
+                    self.views[name] = view
+        return view
+
+    @property
+    def bgr(self):
+        return self.view("bgr", lambda: cv2.cvtColor(self.views["rgb"], cv2.COLOR_RGB2BGR))
+
+    @property
+    def rgb(self):
+        return self.view("rgb", lambda: cv2.cvtColor(self.views["bgr"], cv2.COLOR_BGR2RGB))
+
+    @property
+    def gray(self):
+        if "bgr" in self.views:
+            return self.view("gray", lambda: cv2.cvtColor(self.views["bgr"], cv2.COLOR_BGR2GRAY))
+        return self.view("gray", lambda: cv2.cvtColor(self.views["rgb"], cv2.COLOR_RGB2GRAY))
+
+    @property
+    def pil(self):
+        return self.view("pil", lambda: Image.fromarray(self.rgb))
+
+    def qimage(self):
+        """QImage over the frame's own buffer; copy() it before handing it to another thread."""
+        from PyQt6.QtGui import QImage
+
+        def make():
+            if "bgr" in self.views:
+                array, image_format = np.ascontiguousarray(self.views["bgr"]), QImage.Format.Format_BGR888
+            else:
+                array, image_format = np.ascontiguousarray(self.views["rgb"]), QImage.Format.Format_RGB888
+            self.views["qimage_buffer"] = array  # QImage does not keep the numpy buffer alive
+            return QImage(array.data, array.shape[1], array.shape[0], array.strides[0], image_format)
+        return self.view("qimage", make)
+
+
+def as_frame(image):
+    """Wrap a PIL image as a Frame; Frames are returned unchanged."""
+    if image is None or isinstance(image, Frame):
+        return image
+    return Frame.from_pil(image)
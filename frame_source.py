@@ -0,0 +1,292 @@
+# frame_source.py
+import glob
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from frame import Frame
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def sharpness(gray):
+    """Variance of the Laplacian of a grayscale frame; motion blur lowers it."""
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
+
+
+class FrameSource:
+    """
+    Publishes frames from one producer thread to any number of consumers.
+
+    The newest frame is published as a Frame with a sequence number and a monotonic timestamp.
+    Consumers either take the latest frame without blocking or wait for the next frame after a seq.
+    Subclasses implement run() and call publish() for every frame.
+    """
+    live = True  # False for sources that replay stored frames (there is no motion to settle after)
+    thread_name = "frame-source"
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.seq = 0
+        self.wanted = 1  # highest seq a consumer is waiting for, see next_frame
+        self.recorder = None  # optional SessionRecorder; gets every published frame without blocking
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name=self.thread_name, daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self):
+        raise NotImplementedError
+
+    def publish(self, image, order="bgr", timestamp=None):
+        with self.condition:
+            self.seq += 1
+            frame = Frame(image, order, self.seq, time.monotonic() if timestamp is None else timestamp)
+            self.frame = frame
+            self.condition.notify_all()
+        if self.recorder is not None:
+            self.recorder.submit(frame)
+        return frame
+
+    def finish(self):
+        """Mark the source as stopped and wake every waiting consumer."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def latest(self):
+        """The newest frame, or None if nothing was captured yet. Never blocks."""
+        return self.frame
+
+    def next_frame(self, after_seq=None, timeout=None, demand=True):
+        """
+        Block until a frame newer than `after_seq` is published (default: newer than the current one).
+        With demand=False the caller only watches (e.g. the UI feed) and does not advance a
+        consumer-paced replay. Returns None on timeout or when the source is stopped.
+        """
+        with self.condition:
+            if after_seq is None:
+                after_seq = self.seq
+            if demand and after_seq + 1 > self.wanted:
+                self.wanted = after_seq + 1
+                self.condition.notify_all()
+            ready = self.condition.wait_for(lambda: self.seq > after_seq or not self.running, timeout)
+            if not ready or self.seq <= after_seq:
+                return None
+            return self.frame
+
+    def frame_after(self, not_before, burst=1, timeout=None):
+        """
+        The first frame whose capture timestamp is later than `not_before` (time.monotonic()).
+        With burst > 1, the sharpest of that many consecutive frames. Returns None on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        candidates = []
+        captured = self.latest()
+        seq = 0
+        while len(candidates) < burst:
+            if captured is not None and captured.seq > seq:
+                seq = captured.seq
+                if captured.timestamp > not_before:
+                    candidates.append(captured)
+                continue
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            captured = self.next_frame(seq, remaining)
+            if captured is None:
+                break
+
+        if len(candidates) > 1:
+            return max(candidates, key=lambda frame: sharpness(frame.gray))
+        return candidates[0] if candidates else None
+
+    def stop(self):
+        """Stop the producer thread and release whatever it reads from."""
+        self.finish()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+            self.thread = None
+        self.close()
+
+    def close(self):
+        pass
+
+
+class CameraFrameSource(FrameSource):
+    """
+    Owns a cv2.VideoCapture and reads it from a single grabber thread, so the camera feed, the search
+    rounds and the feedback handler never call read() on the capture concurrently.
+    """
+    thread_name = "frame-grabber"
+
+    def __init__(self, capture, retry_delay=0.05):
+        super().__init__()
+        self.capture = capture
+        self.retry_delay = retry_delay
+        self.failures = 0
+
+    def run(self):
+        while self.running:
+            ret, image = self.capture.read()
+            timestamp = time.monotonic()
+            if not ret or image is None:
+                self.failures += 1
+                if self.failures % 20 == 1:
+                    print(f"Frame capture failed ({self.failures} times)")
+                time.sleep(self.retry_delay)
+                continue
+            self.publish(image, "bgr", timestamp)
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+
+
+class ReplayFrameSource(FrameSource):
+    """
+    Feeds stored images through the same interface as the live camera.
+
+    A prefetch thread decodes (and optionally resizes) the images into a bounded queue ahead of the
+    publisher, which paces them:
+    - realtime: the recorded inter-frame timing (`timestamps`, divided by `speed`), or `fps` when there is none
+    - fixed: `fps` frames per second
+    - fast: consumer-paced; the next frame is published as soon as a consumer asks for it, so
+      benchmarks run as fast as the pipeline allows without skipping frames
+    """
+    live = False
+    thread_name = "frame-replay"
+    PACING = ("realtime", "fixed", "fast")
+
+    def __init__(self, paths, pacing="fast", fps=2.0, size=None, loop=False, prefetch=8, timestamps=None, speed=1.0):
+        super().__init__()
+        if pacing not in self.PACING:
+            raise ValueError(f"Unknown replay pacing {pacing}; choose one of {', '.join(self.PACING)}")
+        if not paths:
+            raise FileNotFoundError("No frames to replay")
+        self.paths = list(paths)
+        self.timestamps = timestamps  # seconds since the start of the recording, one per path
+        self.pacing = pacing
+        self.fps = fps
+        self.speed = speed  # > 1 replays recorded timing accelerated
+        self.size = size  # (width, height) to resize to, or None to keep the stored size
+        self.loop = loop
+        self.decoded = queue.Queue(maxsize=prefetch)
+        self.prefetch_thread = None
+
+    @staticmethod
+    def find_images(directory):
+        """Images directly in `directory`, or else in its session subdirectories, in name order."""
+        paths = sorted(path for path in glob.glob(os.path.join(directory, "*")) if path.lower().endswith(IMAGE_EXTENSIONS))
+        if not paths:
+            for session in sorted(glob.glob(os.path.join(directory, "*", ""))):
+                paths.extend(ReplayFrameSource.find_images(session))
+        return paths
+
+    @classmethod
+    def from_directory(cls, directory, **kwargs):
+        paths = cls.find_images(directory)
+        if not paths:
+            raise FileNotFoundError(f"No images found in folder {directory}")
+        return cls(paths, **kwargs)
+
+    def start(self):
+        if self.prefetch_thread is None:
+            self.running = True
+            self.prefetch_thread = threading.Thread(target=self.prefetch, name="frame-prefetch", daemon=True)
+            self.prefetch_thread.start()
+        return super().start()
+
+    def put(self, item):
+        # Bounded put that gives up once the source is stopped
+        while self.running:
+            try:
+                self.decoded.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def decode(self, path):
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            print(f"Skipping unreadable frame {path}")
+        return image
+
+    def resize(self, image):
+        if self.size is not None and (image.shape[1], image.shape[0]) != tuple(self.size):
+            image = cv2.resize(image, tuple(self.size), interpolation=cv2.INTER_AREA)
+        return image
+
+    def frames(self):
+        """Yields (BGR image, offset in seconds) for one pass over the stored frames."""
+        for index, path in enumerate(self.paths):
+            image = self.decode(path)
+            if image is not None:
+                yield image, self.timestamps[index] if self.timestamps is not None else index / self.fps
+
+    def prefetch(self):
+        while self.running:
+            for image, offset in self.frames():
+                if not self.put((self.resize(image), offset)):
+                    return
+            if not self.loop:
+                break
+        self.put(None)
+
+    def wait_until(self, deadline):
+        # Sleep in short steps so stop() is not held up by a long recorded gap
+        while self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.1))
+
+    def run(self):
+        start = None
+        elapsed = 0.0  # position in the recording, in seconds
+        last_offset = None
+        published = 0
+        while self.running:
+            try:
+                item = self.decoded.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            image, offset = item
+
+            if self.pacing == "fast":
+                with self.condition:
+                    self.condition.wait_for(lambda: self.wanted > self.seq or not self.running)
+            else:
+                if self.pacing == "fixed" or last_offset is None or offset < last_offset:
+                    # Fixed rate, or the first frame of a (looped) pass
+                    elapsed += 0.0 if start is None else 1.0 / self.fps
+                else:
+                    elapsed += (offset - last_offset) / self.speed
+                last_offset = offset
+                if start is None:
+                    start = time.monotonic()
+                self.wait_until(start + elapsed)
+            if not self.running:
+                break
+            self.publish(image, "bgr")
+            published += 1
+
+        print(f"Replay finished after {published} frames")
+        self.finish()
+
+    def close(self):
+        if self.prefetch_thread is not None:
+            self.prefetch_thread.join(timeout=2)
+            self.prefetch_thread = None
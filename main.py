@@ -14,7 +14,10 @@ if __name__ == "__main__":
     app.setFont(QFont('Arial', 10))
     
     mydog = robot_dog.Dog(config.env, config.apikey)
-    mydog.setup()
+    if config.env.get("background_warmup", False):
+        mydog.start_warmup()  # camera setup and model warm-up run while the window is up
+    else:
+        mydog.warmup()
 
     mydog.tts_finished_event = threading.Event()
     
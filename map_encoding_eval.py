@@ -0,0 +1,112 @@
+# map_encoding_eval.py
+"""
+Compares the map encodings of the auto-search prompt (map_encoding_auto: list, grid, rle) on recorded
+rounds, i.e. the rounds.jsonl files OpenaiClient writes into test/test_<timestamp>/.
+
+For every encoding it reports the prompt token counts. With --call it also replays each round's prompt
+(state, detection and memory as recorded, so Subcase 2.x sees the same previous action) against the model
+and reports the latency and how often the action matches the one the LLM answered, i.e. before
+correct_action. Rounds recorded without that action (older sessions) are not scored.
+
+    python map_encoding_eval.py test/test_*/rounds.jsonl
+    python map_encoding_eval.py test/test_*/rounds.jsonl --call --limit 20 --output map_eval.json
+"""
+import argparse
+import json
+import sys
+import time
+
+import yaml
+
+ENCODINGS = ["list", "grid", "rle"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare map encodings of the auto-search prompt on recorded rounds.")
+    parser.add_argument("rounds", nargs="+", help="rounds.jsonl files")
+    parser.add_argument("--env", default="env.yml")
+    parser.add_argument("--apikey", default="apikey.yml")
+    parser.add_argument("--encodings", nargs="+", default=ENCODINGS, choices=ENCODINGS)
+    parser.add_argument("--call", action="store_true", help="send the prompts to ai_model and score the actions")
+    parser.add_argument("--limit", type=int, default=None, help="use only the first N rounds")
+    parser.add_argument("--output", default=None, help="write the JSON report here as well as to stdout")
+    return parser.parse_args()
+
+
+def load_rounds(paths, limit=None):
+    """Recorded auto-search rounds; feedback and policy rounds were decided by a different prompt (or none)."""
+    rounds = []
+    for path in paths:
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        rounds.extend(record for record in records if record.get("prompt") == "auto")
+    return rounds[:limit] if limit else rounds
+
+
+def mean(values):
+    return round(sum(values) / len(values), 2) if values else None
+
+
+def evaluate(env, encoding, rounds, client=None):
+    from ai_client_base import AiClientBase, ResponseMsg
+    from round_memory import token_counter
+
+    prompts = AiClientBase(dict(env, map_encoding_auto=encoding))
+    count_tokens = token_counter(env['ai_model'])
+    prefix = prompts.render_prompt_auto_prefix()
+
+    result = {"prefix_tokens": count_tokens("".join(prefix)), "prompt_tokens": [], "latency_ms": [], "matches": 0, "scored": 0}
+    for recorded in rounds:
+        messages = [
+            {"role": "user", "content": content}
+            for content in prompts.auto_messages(prefix, tuple(recorded["initial_state"]), recorded["description"], recorded.get("memory"))
+        ]
+        result["prompt_tokens"].append(sum(count_tokens(m["content"]) for m in messages))
+        if client is None or "llm_action" not in recorded:
+            continue
+
+        start = time.perf_counter()
+        reply = client.chat.completions.create(model=env['ai_model'], messages=messages, temperature=env['temperature'])
+        result["latency_ms"].append((time.perf_counter() - start) * 1000)
+        action = ResponseMsg.parse(reply.choices[0].message.content).action
+        result["scored"] += 1
+        result["matches"] += action == recorded["llm_action"]
+
+    return {
+        "prefix_tokens": result["prefix_tokens"],
+        "mean_prompt_tokens": mean(result["prompt_tokens"]),
+        "mean_latency_ms": mean(result["latency_ms"]),
+        "action_accuracy": round(result["matches"] / result["scored"], 3) if result["scored"] else None,
+        "rounds": len(result["prompt_tokens"]),
+    }
+
+
+def main():
+    args = parse_args()
+    with open(args.env) as f:
+        env = yaml.safe_load(f)
+
+    client = None
+    if args.call:
+        from openai import OpenAI
+        with open(args.apikey) as f:
+            client = OpenAI(api_key=yaml.safe_load(f)[env["ai"]])
+
+    rounds = load_rounds(args.rounds, args.limit)
+    if not rounds:
+        raise SystemExit("No recorded rounds")
+
+    results = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "ai_model": env["ai_model"], "encodings": {}}
+    for encoding in args.encodings:
+        print(f"Evaluating {encoding} on {len(rounds)} rounds...", file=sys.stderr)
+        results["encodings"][encoding] = evaluate(env, encoding, rounds, client)
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
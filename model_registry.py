@@ -0,0 +1,134 @@
+# model_registry.py
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+import torch
+
+
+@dataclass
+class RegistryEntry:
+    model: object
+    refs: int
+    load_seconds: float
+    memory_bytes: int
+
+
+def module_memory_bytes(model):
+    """Bytes held by the parameters and buffers of every torch module reachable from `model`.
+
+    Handles bare `nn.Module`s, transformers pipelines (`.model`) and wrapper objects such as
+    LangSAM that keep their networks as attributes. Shared tensors are only counted once.
+    """
+    modules = []
+    if isinstance(model, torch.nn.Module):
+        modules.append(model)
+    elif isinstance(getattr(model, "model", None), torch.nn.Module):
+        modules.append(model.model)
+    else:
+        for value in vars(model).values() if hasattr(model, "__dict__") else []:
+            if isinstance(value, torch.nn.Module):
+                modules.append(value)
+            elif isinstance(getattr(value, "model", None), torch.nn.Module):
+                modules.append(value.model)
+
+    seen = set()
+    total = 0
+    for module in modules:
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            if tensor.data_ptr() in seen:
+                continue
+            seen.add(tensor.data_ptr())
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def process_rss_bytes():
+    """Current resident set size of this process (Linux), or 0 if it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class ModelRegistry:
+    """
+    Process-wide, reference-counted store of loaded models keyed by (model name, device, dtype).
+
+    Every VisionModel asks the registry for its networks, so the Dog and the OpenaiClient share
+    one copy of ZoeDepth and of the detector instead of loading the weights twice.
+    """
+    _entries = {}
+    _lock = threading.Lock()
+    _key_locks = {}
+
+    @staticmethod
+    def make_key(name, device, dtype):
+        return (name, str(device), str(dtype))
+
+    @classmethod
+    def acquire(cls, name, device, dtype, loader):
+        """Return the resident model for the key, calling `loader()` only on the first request."""
+        key = cls.make_key(name, device, dtype)
+        with cls._lock:
+            key_lock = cls._key_locks.setdefault(key, threading.Lock())
+
+        # Loading can take seconds; only requests for the same key wait on each other
+        with key_lock:
+            with cls._lock:
+                entry = cls._entries.get(key)
+                if entry is not None:
+                    entry.refs += 1
+                    return entry.model
+
+            start = time.perf_counter()
+            model = loader()
+            load_seconds = time.perf_counter() - start
+            entry = RegistryEntry(model, 1, load_seconds, module_memory_bytes(model))
+            with cls._lock:
+                cls._entries[key] = entry
+            print(f"Loaded {name} on {device} in {load_seconds:.1f}s ({entry.memory_bytes / 2**20:.0f} MB)")
+            return model
+
+    @classmethod
+    def release(cls, name, device, dtype):
+        """Drop one reference; the weights are freed when the last consumer releases them."""
+        key = cls.make_key(name, device, dtype)
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is None:
+                return
+            entry.refs -= 1
+            if entry.refs > 0:
+                return
+            del cls._entries[key]
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    @classmethod
+    def resident(cls):
+        """Snapshot of the resident models with their reference counts and memory use."""
+        with cls._lock:
+            return [
+                {
+                    "name": name,
+                    "device": device,
+                    "dtype": dtype,
+                    "refs": entry.refs,
+                    "memory_mb": round(entry.memory_bytes / 2**20, 1),
+                    "load_seconds": round(entry.load_seconds, 2),
+                }
+                for (name, device, dtype), entry in cls._entries.items()
+            ]
+
+    @classmethod
+    def report(cls):
+        lines = [f"Resident models (process RSS {process_rss_bytes() / 2**20:.0f} MB):"]
+        for info in cls.resident():
+            lines.append(
+                f"- {info['name']} [{info['device']}, {info['dtype']}]: "
+                f"{info['memory_mb']} MB, {info['refs']} ref(s), loaded in {info['load_seconds']}s"
+            )
+        return "\n".join(lines)
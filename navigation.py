@@ -262,6 +262,45 @@ class Mapping:
             if (point[0], point[1]) not in self.excluded_points:
                 self.obstacles[f"border_{idx}"] = (point[0], point[1], 0)
 
+    def blocked_cells(self):
+        return {(coords[0], coords[1]) for coords in self.obstacles.values()}
+
+    def grid_rows(self):
+        """(y, [(x, blocked), ...]) for every row of the map including the border, top (north) row first."""
+        border_size = NaviConfig.border_size
+        blocked = self.blocked_cells()
+        return [
+            (y, [(x, (x, y) in blocked) for x in range(-border_size, border_size + 1)])
+            for y in range(border_size + 1, -border_size - 2, -1)
+        ]
+
+    def occupancy_grid(self):
+        """The map as an ASCII grid: one line per y, '#' for a blocked cell and '.' for a free one."""
+        border_size = NaviConfig.border_size
+        lines = [
+            f"Map: one row per y (north at the top), columns x = {-border_size} to {border_size} from left to right. "
+            f"'#' is an obstacle or border, '.' is a cell you can navigate to."
+        ]
+        for y, cells in self.grid_rows():
+            lines.append(f"y={y:>2}: " + " ".join("#" if cell_blocked else "." for _, cell_blocked in cells))
+        return "\n".join(lines)
+
+    def run_length_rows(self):
+        """The map as run-length rows: the x ranges you can navigate to in each y; every other cell is blocked."""
+        lines = ["Free cells as x ranges per y (every other cell is an obstacle or border):"]
+        for y, cells in self.grid_rows():
+            runs = []
+            for x, cell_blocked in cells:
+                if cell_blocked:
+                    continue
+                if runs and runs[-1][1] == x - 1:
+                    runs[-1][1] = x
+                else:
+                    runs.append([x, x])
+            if runs:
+                lines.append(f"y={y}: " + ", ".join(f"{start}..{end}" if start != end else f"{start}" for start, end in runs))
+        return "\n".join(lines)
+
 if __name__ == "__main__":
     # Load configuration from env.yml
     with open('env.yml', 'r') as file:
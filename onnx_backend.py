@@ -0,0 +1,227 @@
+# onnx_backend.py
+"""
+ONNX Runtime CPU path for the OWLv2 detector and the depth model.
+
+Export once (optionally with dynamic int8 weight quantization), then select the runtime in env.yml:
+
+    python onnx_backend.py export --int8
+    python onnx_backend.py parity          # compare against PyTorch on test_dataset images
+
+    detection_runtime: onnx
+    depth_runtime: onnx
+"""
+import argparse
+import glob
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import yaml
+from PIL import Image
+from transformers import AutoImageProcessor, AutoModelForDepthEstimation, Owlv2ForObjectDetection, Owlv2Processor
+
+from utils import label_list
+from vision import owlv2_detections
+
+OWLV2_CHECKPOINT = "google/owlv2-base-patch16-ensemble"
+OPSET_VERSION = 17
+
+
+def import_onnxruntime():
+    import onnxruntime
+    return onnxruntime
+
+
+def onnx_path(onnx_dir, checkpoint, int8):
+    name = checkpoint.replace("/", "__")
+    return os.path.join(onnx_dir, f"{name}{'.int8' if int8 else ''}.onnx")
+
+
+def quantize_int8(fp32_path, int8_path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"Quantized {fp32_path} -> {int8_path}")
+
+
+def make_session(path, threads=0):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"ONNX model {path} not found. Run 'python onnx_backend.py export' first.")
+    ort = import_onnxruntime()
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        options.intra_op_num_threads = threads
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+class _Owlv2Outputs(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, pixel_values, attention_mask):
+        outputs = self.model(input_ids=input_ids, pixel_values=pixel_values, attention_mask=attention_mask)
+        return outputs.logits, outputs.pred_boxes
+
+
+class _DepthOutputs(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).predicted_depth
+
+
+def export_owlv2(env, onnx_dir, int8=False, checkpoint=OWLV2_CHECKPOINT):
+    processor = Owlv2Processor.from_pretrained(checkpoint)
+    model = Owlv2ForObjectDetection.from_pretrained(checkpoint).eval()
+    dummy = Image.new("RGB", (env["captured_width"], env["captured_height"]), "black")
+    inputs = processor(text=[label_list(env["target_in_test_dataset"])], images=dummy, return_tensors="pt")
+
+    path = onnx_path(onnx_dir, checkpoint, int8=False)
+    os.makedirs(onnx_dir, exist_ok=True)
+    with torch.inference_mode():
+        torch.onnx.export(
+            _Owlv2Outputs(model),
+            (inputs["input_ids"], inputs["pixel_values"], inputs["attention_mask"]),
+            path,
+            input_names=["input_ids", "pixel_values", "attention_mask"],
+            output_names=["logits", "pred_boxes"],
+            dynamic_axes={"input_ids": {0: "num_queries"}, "attention_mask": {0: "num_queries"}, "logits": {2: "num_queries"}},
+            opset_version=OPSET_VERSION,
+        )
+    print(f"Exported {checkpoint} -> {path}")
+    if int8:
+        quantize_int8(path, onnx_path(onnx_dir, checkpoint, int8=True))
+
+
+def export_depth(env, onnx_dir, checkpoint, int8=False):
+    processor = AutoImageProcessor.from_pretrained(checkpoint)
+    model = AutoModelForDepthEstimation.from_pretrained(checkpoint).eval()
+    dummy = Image.new("RGB", (env["captured_width"], env["captured_height"]), "black")
+    inputs = processor(images=dummy, return_tensors="pt")
+
+    # The camera resolution is fixed, so the graph is exported for that input size only
+    path = onnx_path(onnx_dir, checkpoint, int8=False)
+    os.makedirs(onnx_dir, exist_ok=True)
+    with torch.inference_mode():
+        torch.onnx.export(
+            _DepthOutputs(model),
+            (inputs["pixel_values"],),
+            path,
+            input_names=["pixel_values"],
+            output_names=["predicted_depth"],
+            opset_version=OPSET_VERSION,
+        )
+    print(f"Exported {checkpoint} -> {path}")
+    if int8:
+        quantize_int8(path, onnx_path(onnx_dir, checkpoint, int8=True))
+
+
+class OnnxOwlv2Detector:
+    """Drop-in replacement for the zero-shot-object-detection pipeline, backed by ONNX Runtime."""
+    def __init__(self, model_path, checkpoint=OWLV2_CHECKPOINT, threads=0, threshold=0.1):
+        self.processor = Owlv2Processor.from_pretrained(checkpoint)
+        self.session = make_session(model_path, threads)
+        self.threshold = threshold
+
+    def run(self, image_pil, candidate_labels):
+        labels = label_list(candidate_labels)
+        inputs = self.processor(text=[labels], images=image_pil, return_tensors="np")
+        logits, pred_boxes = self.session.run(None, {
+            "input_ids": inputs["input_ids"].astype(np.int64),
+            "pixel_values": inputs["pixel_values"].astype(np.float32),
+            "attention_mask": inputs["attention_mask"].astype(np.int64),
+        })
+        return labels, logits, pred_boxes
+
+    def __call__(self, image_pil, candidate_labels):
+        labels, logits, pred_boxes = self.run(image_pil, candidate_labels)
+        return owlv2_detections(self.processor, torch.from_numpy(logits), torch.from_numpy(pred_boxes), labels, image_pil.size, self.threshold)
+
+
+class OnnxDepthEstimator:
+    """Drop-in replacement for the depth-estimation pipeline; returns {"predicted_depth": tensor}."""
+    def __init__(self, model_path, checkpoint, threads=0):
+        self.processor = AutoImageProcessor.from_pretrained(checkpoint)
+        self.session = make_session(model_path, threads)
+
+    def __call__(self, image_pil):
+        inputs = self.processor(images=image_pil, return_tensors="np")
+        (predicted_depth,) = self.session.run(None, {"pixel_values": inputs["pixel_values"].astype(np.float32)})
+        return {"predicted_depth": torch.from_numpy(predicted_depth)}
+
+
+def test_images(env, limit=None):
+    folder = os.path.join(Path(__file__).parent, f"test_dataset/{env['target_in_test_dataset']}")
+    images = sorted(glob.glob(os.path.join(folder, "*.jpg")))
+    if not images:
+        raise FileNotFoundError(f"No images found in folder {folder}")
+    return images[:limit] if limit else images
+
+
+def check_parity(env, onnx_dir, depth_checkpoint, int8=False, limit=None):
+    """Compare raw ONNX outputs against eager PyTorch on the test_dataset images and print the differences."""
+    labels = label_list(env["target_in_test_dataset"])
+    owl_processor = Owlv2Processor.from_pretrained(OWLV2_CHECKPOINT)
+    owl_torch = Owlv2ForObjectDetection.from_pretrained(OWLV2_CHECKPOINT).eval()
+    owl_onnx = OnnxOwlv2Detector(onnx_path(onnx_dir, OWLV2_CHECKPOINT, int8), threads=env.get("onnx_threads", 0))
+    depth_processor = AutoImageProcessor.from_pretrained(depth_checkpoint)
+    depth_torch = AutoModelForDepthEstimation.from_pretrained(depth_checkpoint).eval()
+    depth_onnx = OnnxDepthEstimator(onnx_path(onnx_dir, depth_checkpoint, int8), depth_checkpoint, threads=env.get("onnx_threads", 0))
+
+    # The depth graph is exported for captured_width x captured_height, so frames are resized like replay_resize does
+    export_size = (env["captured_width"], env["captured_height"])
+    rows = []
+    for path in test_images(env, limit):
+        image = Image.open(path).convert("RGB")
+        if image.size != export_size:
+            image = image.resize(export_size, Image.BOX)
+        with torch.inference_mode():
+            start = time.perf_counter()
+            owl_ref = owl_torch(**owl_processor(text=[labels], images=image, return_tensors="pt"))
+            depth_ref = depth_torch(**depth_processor(images=image, return_tensors="pt")).predicted_depth
+            torch_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, logits, pred_boxes = owl_onnx.run(image, labels)
+        depth = depth_onnx(image)["predicted_depth"]
+        onnx_seconds = time.perf_counter() - start
+
+        rows.append({
+            "image": os.path.basename(path),
+            "logits_max_abs": float(np.abs(logits - owl_ref.logits.numpy()).max()),
+            "boxes_max_abs": float(np.abs(pred_boxes - owl_ref.pred_boxes.numpy()).max()),
+            "depth_mean_rel": float((torch.abs(depth - depth_ref) / depth_ref.clamp(min=1e-6)).mean()),
+            "torch_ms": torch_seconds * 1000,
+            "onnx_ms": onnx_seconds * 1000,
+        })
+
+    for row in rows:
+        print(f"{row['image']}: logits max|d| {row['logits_max_abs']:.4f}, boxes max|d| {row['boxes_max_abs']:.4f}, "
+              f"depth mean rel {row['depth_mean_rel']:.3%}, torch {row['torch_ms']:.0f} ms, onnx {row['onnx_ms']:.0f} ms")
+    return rows
+
+
+if __name__ == "__main__":
+    with open("env.yml") as f:
+        env = yaml.safe_load(f)
+
+    parser = argparse.ArgumentParser(description="Export and check ONNX versions of the vision models.")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--int8", action="store_true", default=env.get("onnx_int8", False), help="dynamic int8 weight quantization")
+    parser.add_argument("--onnx-dir", default=env.get("onnx_dir", "onnx_models"))
+    parser.add_argument("--depth-backend", default=env.get("depth_backend", "zoedepth"), help="name from vision.DEPTH_BACKENDS")
+    parser.add_argument("--limit", type=int, default=None, help="number of test_dataset images for the parity check")
+    args = parser.parse_args()
+
+    from vision import DEPTH_BACKENDS
+    depth_checkpoint = DEPTH_BACKENDS[args.depth_backend].checkpoint
+    if args.command == "export":
+        export_owlv2(env, args.onnx_dir, int8=args.int8)
+        export_depth(env, args.onnx_dir, depth_checkpoint, int8=args.int8)
+    else:
+        check_parity(env, args.onnx_dir, depth_checkpoint, int8=args.int8, limit=args.limit)
@@ -2,8 +2,12 @@
 import os
 import base64
 import datetime
+import json
 import wave
 import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pyaudio
 from pydub import AudioSegment
 from pydub.effects import speedup
@@ -12,12 +16,15 @@ from pydub.playback import play
 from openai import OpenAI
 import cv2
 
-from ai_client_base import AiClientBase, ResponseMsg
+from ai_client_base import AiClientBase, ResponseMsg, ResponseStreamParser
 from vision import VisionModel
+from vision_worker import RemoteVisionModel
 from navigation import NaviModel, Mapping
 from navi_config import NaviConfig
+from policy import SearchPolicy
 
 # from round import Round
+from round_memory import RoundMemory
 import utils
 from round import Round
 
@@ -32,6 +39,7 @@ class OpenaiClient(AiClientBase):
         self.chat = []
         self.curr_state = utils.string_to_tuple(self.env['curr_state'])
         self.memory_list = []
+        self.round_memory = RoundMemory.from_env(self.env)  # what the prompts get of memory_list
         self.is_initial_prompt_landmark_or_non_command = True
         self.is_initial_response_format_non_command = True
         self.is_landmark_action = False
@@ -57,69 +65,105 @@ class OpenaiClient(AiClientBase):
             self.snack_area2
         ))
 
+        # Everything of the auto-search prompt that depends only on env and NaviConfig, rendered once.
+        # It leads every round's messages unchanged so the provider can serve it from its prompt cache.
+        self.prompt_auto_prefix = self.render_prompt_auto_prefix()
+        self.cache_metrics = []  # per call: prompt tokens and how many of them were cached
+        self.round_metrics = {}  # prompt tokens and LLM latency of the current round, written to rounds.jsonl
+
         self.client = OpenAI(api_key=key)
-        self.vision_model = VisionModel(self.env)
+        # Same API either way; the worker process keeps inference off the UI/motion threads' GIL
+        self.vision_model = RemoteVisionModel(self.env) if self.env.get("vision_worker_process", False) else VisionModel(self.env)
         self.navi_model = NaviModel()
         self.mapping = Mapping()
 
+        # decision_engine: policy decides the action locally and only asks the LLM for the reason, in the background
+        self.policy = SearchPolicy(self.env) if self.env.get('decision_engine', 'llm') == 'policy' else None
+        self.narrator = ThreadPoolExecutor(max_workers=1, thread_name_prefix="narrator") if self.policy else None
+        self.log_lock = threading.Lock()
+
+        # stream_response: read the reply as it is generated and move as soon as the Action line is complete
+        self.streamer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-stream") if self.env.get('stream_response', False) else None
+        self.stream_metrics = []  # per streamed call: time to first token, to the action and to the full reply
+
         try:
             os.makedirs('test', exist_ok=True)
             self.save_dir = f"test/test_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
             os.mkdir(self.save_dir)
             self.log_file = open(f"{self.save_dir}/log.log", "a+") # append: a+ overwrite: w+
+            self.rounds_file = open(f"{self.save_dir}/rounds.jsonl", "a+") # one JSON record per round, for map_encoding_eval.py
         except Exception as e:
             print(f"Failed to create directory: {e}")
 
     def set_target(self, target):
         self.target = target
 
-    def update_memory_list(self, detected_objects, distances, description, chat, assistant):
+    def update_memory_list(self, detected_objects, distances, description, chat, assistant, prompt="auto"):
+        """`prompt` is the prompt that produced the action: auto, feedback or policy (no prompt)."""
         round = Round(self.round_number, detected_objects, distances, description, chat, assistant)
         self.curr_state = round.assistant.new_state
 
-        self.log_file.write(
-            f"Round {round.round_number}:\n"
-            f"- Detected Objects: {round.detected_objects if round.detected_objects else 'None'}\n"
-            f"- Distances: {round.distances if round.distances else 'None'}\n"
-            f"- Description: {round.description if round.description else 'None'}\n"
-            f"- Chat: {round.chat if round.chat else 'None'}\n"
-            f"- Initial State: {round.assistant.initial_state}\n"
-            f"- Action: {round.assistant.action}\n"
-            f"- New State: {round.assistant.new_state}\n"
-            f"- Reason: {round.assistant.reason if round.assistant.reason else 'None'}\n\n"
-        )
-
-        self.log_file.flush()
+        reason = round.assistant.reason
+        if round.assistant.reason_future is not None and not round.assistant.reason_future.done():
+            reason = "(pending)"
+
+        map_encodings = {"auto": self.env.get('map_encoding_auto', 'rle'), "feedback": self.env.get('map_encoding_feedback', 'list')}
+
+        with self.log_lock:
+            self.log_file.write(
+                f"Round {round.round_number}:\n"
+                f"- Detected Objects: {round.detected_objects if round.detected_objects else 'None'}\n"
+                f"- Distances: {round.distances if round.distances else 'None'}\n"
+                f"- Description: {round.description if round.description else 'None'}\n"
+                f"- Chat: {round.chat if round.chat else 'None'}\n"
+                f"- Initial State: {round.assistant.initial_state}\n"
+                f"- Action: {round.assistant.action}\n"
+                f"- New State: {round.assistant.new_state}\n"
+                f"- Reason: {reason if reason else 'None'}\n\n"
+            )
+            self.log_file.flush()
+            self.rounds_file.write(json.dumps({
+                "round": round.round_number,
+                "initial_state": list(round.assistant.initial_state),
+                "detected_objects": list(round.detected_objects),
+                "distances": [str(distance) for distance in round.distances],
+                "description": list(round.description),
+                "action": list(round.assistant.action),
+                "new_state": list(round.assistant.new_state),
+                "prompt": prompt,
+                "map_encoding": map_encodings.get(prompt),
+                **self.round_metrics,
+            }) + "\n")
+            self.rounds_file.flush()
+        self.round_metrics = {}
         self.round_number += 1
         self.memory_list.append(round)
+        self.round_memory.add(round)
 
         return round.assistant
 
-    def construct_detection_auto(self, description):
-        return (
-            f"Detection:\n"
-            f"(The image size is {self.env['captured_width']}x{self.env['captured_height']}, "
-            f"with the pixel index (0, 0) located at the top-left corner.)\n"
-            f"{description} \n\n"
-        )
-
     def construct_detection_feedback(self, detected_objects):
         return (
             f"Detection:\n"
             f"{detected_objects} \n\n"
         )
 
-    def construct_memory(self, memory):
-        return (
-            f"Memory:\n {memory}\n\n"
-        )
+    def log_prompt_tokens(self, message):
+        total = sum(self.round_memory.count_tokens(m['content']) for m in message)
+        self.round_metrics["prompt_tokens"] = total
+        line = f"Prompt tokens (round {self.round_number}): {total} total, {self.round_memory.last_tokens} memory"
+        print(line)
+        with self.log_lock:
+            self.log_file.write(line + "\n\n")
+            self.log_file.flush()
+        return total
 
     def detectable_area(self, x_range, y_range, z_value):
         points_inside = [(x, y, z_value) for x in x_range for y in y_range]
         return points_inside
     
     def analyze_image(self, image_pil):
-        image_analysis = self.vision_model.describe_image(image_pil)
+        image_analysis = self.vision_model.describe_image(image_pil, state=self.curr_state)
 
         self.check_and_update_analysis(
             image_analysis, 
@@ -157,7 +201,8 @@ class OpenaiClient(AiClientBase):
             self.env['object4']
         )
 
-        return image_analysis.frame, image_analysis.detected_objects, image_analysis.distances, image_analysis.description
+        # The response itself is returned in place of the annotated frame so it is only rendered when stored
+        return image_analysis, image_analysis.detected_objects, image_analysis.distances, image_analysis.description
 
     def check_and_update_analysis(self, image_analysis, detectable_area, object_name):
         if self.curr_state in detectable_area and object_name not in image_analysis.detected_objects:
@@ -220,7 +265,91 @@ class OpenaiClient(AiClientBase):
             messages=message,
             temperature=self.env['temperature']
         )
+        self.report_usage(result.usage)
         return result.choices[0].message.content
+
+    def report_usage(self, usage):
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        self.cache_metrics.append({"prompt_tokens": usage.prompt_tokens, "cached_tokens": cached})
+        ratio = cached / usage.prompt_tokens if usage.prompt_tokens else 0.0
+        print(f"Prompt cache: {cached}/{usage.prompt_tokens} prompt tokens cached ({ratio:.0%})")
+
+    def stream_ai_response(self, message):
+        """Yields the reply text as the chunks arrive."""
+        stream = self.client.chat.completions.create(
+            model=self.env['ai_model'],
+            messages=message,
+            temperature=self.env['temperature'],
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if getattr(chunk, "usage", None) is not None:
+                # Sent in a final chunk without choices
+                self.report_usage(chunk.usage)
+
+    def get_streamed_response(self, message, act_early):
+        """
+        Streams the reply on the llm-stream thread. With act_early, returns as soon as the Action line is
+        parsed; the rest of the reply (the reason) keeps streaming and fills in reason_future.
+        """
+        start = time.monotonic()
+        metrics = {"round": self.round_number, "first_token_ms": None, "action_ms": None, "total_ms": None, "early": False}
+        action_ready = threading.Event()
+
+        def action_parsed(parser):
+            metrics["action_ms"] = (time.monotonic() - start) * 1000
+            action_ready.set()
+
+        parser = ResponseStreamParser(on_action=action_parsed)
+
+        def consume():
+            for text in self.stream_ai_response(message):
+                if metrics["first_token_ms"] is None:
+                    metrics["first_token_ms"] = (time.monotonic() - start) * 1000
+                parser.feed(text)
+            parser.close()
+            metrics["total_ms"] = (time.monotonic() - start) * 1000
+            self.report_stream_metrics(metrics)
+            return parser.reason
+
+        future = self.streamer.submit(consume)
+        future.add_done_callback(lambda _: action_ready.set())  # also wakes the round when the stream fails
+
+        if act_early:
+            action_ready.wait()
+            if not future.done():
+                try:
+                    assistant = parser.response()
+                except ValueError as e:
+                    print(f"Streamed action could not be parsed early ({e}); waiting for the full reply")
+                else:
+                    metrics["early"] = True
+                    assistant.reason_future = future
+                    assistant.reason_future.add_done_callback(
+                        lambda future, round_number=self.round_number: self.set_reason(assistant, round_number, future)
+                    )
+                    return assistant
+
+        future.result()
+        return ResponseMsg.parse(parser.text)
+
+    def report_stream_metrics(self, metrics):
+        self.stream_metrics.append(metrics)
+        line = (
+            f"LLM stream (round {metrics['round']}): first token {metrics['first_token_ms'] or 0:.0f} ms, "
+            f"action {metrics['action_ms'] or 0:.0f} ms, complete {metrics['total_ms']:.0f} ms"
+            f"{', acted early' if metrics['early'] else ''}"
+        )
+        print(line)
+        with self.log_lock:
+            self.log_file.write(line + "\n\n")
+            self.log_file.flush()
     
     def string_to_tuple(self, input_string):
         # Remove markdown code block formatting if present
@@ -232,10 +361,11 @@ class OpenaiClient(AiClientBase):
 
     def initialize_prompt_auto(self, description):
         self.msg.clear()
-        self.append_message(self.msg, "user", self.prompt_auto(self.curr_state))
-        self.append_message(self.msg, "user", self.construct_detection_auto(description))
-        self.append_message(self.msg, "user", self.construct_memory(self.memory_list))
-        self.append_message(self.msg, "user", self.response_format_auto())
+        memory = self.round_memory.render()
+        # Recorded so map_encoding_eval.py can replay the round with the memory (and previous action) it saw
+        self.round_metrics["memory"] = memory
+        for content in self.auto_messages(self.prompt_auto_prefix, self.curr_state, description, memory):
+            self.append_message(self.msg, "user", content)
     
     def check_action_same_as_previous_round(self, action, reason):
         if self.memory_list:
@@ -317,17 +447,28 @@ class OpenaiClient(AiClientBase):
             return None
         
         # Analyze image
-        frame_bboxes_array, detected_objects, distances, description = self.analyze_image(image_pil)
+        image_analysis, detected_objects, distances, description = self.analyze_image(image_pil)
+
+        if self.policy is not None:
+            return self.get_response_by_policy(image_analysis, dog_instance)
         
         # Initialize messages
         self.initialize_prompt_auto(description)
+        self.log_prompt_tokens(self.msg)
         
         # Check for feedback interruption early in the function
         if dog_instance.check_feedback_and_interruption():
             return None
 
-        rawAssistant = self.get_ai_response(self.msg)
-        assistant = ResponseMsg.parse(rawAssistant)
+        llm_start = time.monotonic()
+        if self.streamer is not None:
+            # correct_action may replace the action, so only act before the reply is complete when it cannot apply
+            assistant = self.get_streamed_response(self.msg, act_early=self.curr_state not in self.all_detectable_areas)
+        else:
+            rawAssistant = self.get_ai_response(self.msg)
+            assistant = ResponseMsg.parse(rawAssistant)
+        self.round_metrics["llm_ms"] = round((time.monotonic() - llm_start) * 1000, 1)
+        self.round_metrics["llm_action"] = list(assistant.action)
 
         # Post-processing assistant
         if self.curr_state in self.all_detectable_areas:
@@ -341,17 +482,55 @@ class OpenaiClient(AiClientBase):
             return None  
 
         # Update data
-        self.store_image(frame_bboxes_array)
+        self.store_image(image_analysis.frame)
         self.update_memory_list(detected_objects, distances, description, self.chat, assistant)
 
         return assistant
     
+    def get_response_by_policy(self, image_analysis, dog_instance):
+        previous_action = self.memory_list[-1].assistant.action if self.memory_list else None
+        action, subcase = self.policy.decide(image_analysis, previous_action)
+        new_state = self.policy.new_state(self.curr_state, action)
+        print(f"Policy: subcase {subcase}, action {action}")
+
+        if dog_instance.check_feedback_and_interruption():
+            return None
+
+        # The round actuates now; the annotated image and the reason are produced in the background,
+        # in that order on the single narrator thread, so images keep the round order
+        assistant = ResponseMsg(self.curr_state, new_state, action, "")
+        # Reading image_analysis.frame renders the boxes, so that happens on the narrator as well
+        self.narrator.submit(lambda: self.store_image(image_analysis.frame))
+        assistant.reason_future = self.narrator.submit(self.narrate, self.curr_state, image_analysis.description, action)
+        assistant.reason_future.add_done_callback(lambda future, round_number=self.round_number: self.set_reason(assistant, round_number, future))
+
+        self.update_memory_list(image_analysis.detected_objects, image_analysis.distances, image_analysis.description, self.chat, assistant, prompt="policy")
+
+        return assistant
+
+    def narrate(self, curr_state, description, action):
+        msg = []
+        self.append_message(msg, "user", self.initial_prompt(curr_state))
+        self.append_message(msg, "user", self.construct_detection_auto(description))
+        self.append_message(msg, "user", self.response_format_reason(action))
+        return self.get_ai_response(msg).strip()
+
+    def set_reason(self, assistant, round_number, future):
+        try:
+            assistant.reason = future.result()
+        except Exception as e:
+            print(f"Failed to generate the reason for round {round_number}: {e}")
+            return
+        with self.log_lock:
+            self.log_file.write(f"Round {round_number} reason: {assistant.reason}\n\n")
+            self.log_file.flush()
+
     def initial_prompt_feedback(self, detected_objects):
         # Initialize messages
         if self.is_initial_prompt_landmark_or_non_command:
             self.append_message(self.msg_feedback, "user", self.prompt_landmark_or_non_command(self.curr_state))
             self.append_message(self.msg_feedback, "user", self.construct_detection_feedback(detected_objects))
-            self.append_message(self.msg_feedback, "user", self.construct_memory(self.memory_list))      
+            self.append_message(self.msg_feedback, "user", self.construct_memory(self.round_memory.render()))      
             self.is_initial_prompt_landmark_or_non_command = False
 
     def initial_response_format_non_command(self):  
@@ -361,12 +540,12 @@ class OpenaiClient(AiClientBase):
 
     def feedback_mode_on(self, image_pil):
         # Analyze image
-        frame_bboxes_array, detected_objects, distances, description = self.analyze_image(image_pil)
+        image_analysis, detected_objects, distances, description = self.analyze_image(image_pil)
 
         # Initialize messages
         self.initial_prompt_feedback(detected_objects)
         
-        return frame_bboxes_array, detected_objects, distances, description
+        return image_analysis, detected_objects, distances, description
 
     def get_response_non_command(self, user_input):
         self.initial_response_format_non_command()
@@ -379,7 +558,7 @@ class OpenaiClient(AiClientBase):
 
         return rawAssistant
         
-    def get_response_landmark_or_general_command(self, user_input, frame_bboxes_array, detected_objects, distances, description):
+    def get_response_landmark_or_general_command(self, user_input, image_analysis, detected_objects, distances, description):
         # Append user input to messages
         self.append_message(self.msg_feedback, "user", user_input)
         self.append_message(self.chat, "user", user_input)
@@ -403,9 +582,9 @@ class OpenaiClient(AiClientBase):
             assistant = ResponseMsg.parse(rawAssistant)
 
         # Update data
-        image_pil_fmode = utils.put_text_top_left(frame_bboxes_array, text="Feedback mode")
-        self.store_image(image_pil_fmode)
-        self.update_memory_list(detected_objects, distances, description, self.chat, assistant)
+        image_fmode = utils.put_text_top_left(image_analysis.frame, text="Feedback mode")
+        self.store_image(image_fmode)
+        self.update_memory_list(detected_objects, distances, description, self.chat, assistant, prompt="feedback")
         self.msg_feedback.clear()
         self.chat.clear()
         self.is_initial_prompt_landmark_or_non_command = True
@@ -516,7 +695,13 @@ class OpenaiClient(AiClientBase):
     #     return text
 
     def close(self):
+        if self.narrator is not None:
+            self.narrator.shutdown(wait=True)
+        if self.streamer is not None:
+            self.streamer.shutdown(wait=True)
+        self.vision_model.unload()
         self.log_file.close()
+        self.rounds_file.close()
 
     def is_instruction_command(self, input): 
         msg = []
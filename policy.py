@@ -0,0 +1,115 @@
+# policy.py
+from dataclasses import dataclass
+
+import utils
+from navigation import NaviModel
+
+
+@dataclass
+class Detection:
+    label: str
+    distance: float
+    position: str  # 'left', 'middle' or 'right' third of the frame
+
+
+class SearchPolicy:
+    """
+    The decision table of AiClientBase.prompt_auto, evaluated locally.
+
+    Case 1 (the target is detected) and Case 2 (landmarks only) map a detection to the same actions the
+    prompt asks the LLM for, using the same distance bands (stop_target, stop_landmark, threshold_range),
+    so a round can actuate as soon as describe_image returns. The LLM is only asked for the reason.
+    """
+    ROTATIONS = ("turn right", "turn left")
+
+    def __init__(self, env):
+        self.env = env
+        # Labels are compared normalized: owlv2 reports the query phrase, e.g. "apple." for target apple
+        self.target = utils.normalize_label(env['target'])
+        self.stop_target = float(env['stop_target'])
+        self.stop_landmark = float(env['stop_landmark'])
+        self.threshold_range = float(env['threshold_range'])
+        self.kitchen_landmarks = [utils.normalize_label(env['object2'])]  # Subcase 2.1
+        self.food_landmarks = [utils.normalize_label(env[name]) for name in ('object3', 'object4', 'object5')]  # Subcase 2.2
+        self.other_landmarks = [utils.normalize_label(env[name]) for name in ('object6', 'object7')]  # Subcase 2.3
+
+    def detections(self, image_analysis):
+        """
+        Detections of a VisionResponse. Objects appended without a box (the simulated landmarks of
+        OpenaiClient.check_and_update_analysis) count as in the middle of the frame.
+        """
+        detections = []
+        for i, (label, distance) in enumerate(zip(image_analysis.detected_objects, image_analysis.distances)):
+            try:
+                distance = float(distance)
+            except (TypeError, ValueError):
+                continue
+            position = "middle"
+            if i < len(image_analysis.boxes):
+                x1, _, x2, _ = image_analysis.boxes[i]
+                center_x = (x1 + x2) / 2
+                if center_x < self.env["captured_width"] * self.env["left_frame"]:
+                    position = "left"
+                elif center_x > self.env["captured_width"] * self.env["right_frame"]:
+                    position = "right"
+            detections.append(Detection(utils.normalize_label(label), distance, position))
+        return detections
+
+    def rotate(self, previous_action):
+        # Keep turning the way the previous rotation went so the robot does not swing back and forth
+        for action in reversed(previous_action or []):
+            if action in self.ROTATIONS:
+                return [action]
+        return [self.ROTATIONS[0]]
+
+    def nearest(self, detections, labels):
+        found = [detection for detection in detections if detection.label in labels]
+        return min(found, key=lambda detection: detection.distance) if found else None
+
+    def decide_target(self, targets):
+        middle = [detection for detection in targets if detection.position == "middle"]
+        if middle:
+            distance = min(detection.distance for detection in middle)
+            if distance > self.stop_target + self.threshold_range:
+                return ['move forward'] * 2, "1.1"
+            if distance > self.stop_target:
+                return ['move forward'], "1.1"
+            return ['stop'], "1.2"
+        # Targets on both sides: turn towards the nearest one
+        nearest = min(targets, key=lambda detection: detection.distance)
+        if nearest.position == "left":
+            return ['turn left 30'], "1.3"
+        return ['turn right 30'], "1.4"
+
+    def decide(self, image_analysis, previous_action=None):
+        """Returns (action list, subcase) for one round."""
+        detections = self.detections(image_analysis)
+
+        targets = [detection for detection in detections if detection.label == self.target]
+        if targets:
+            return self.decide_target(targets)
+
+        landmark = self.nearest(detections, self.kitchen_landmarks)
+        if landmark is not None:
+            for steps in range(7, 1, -1):
+                if landmark.distance > self.stop_landmark + self.threshold_range * (steps - 1):
+                    return ['move forward'] * steps, "2.1"
+            return self.rotate(previous_action), "2.1"
+
+        landmark = self.nearest(detections, self.food_landmarks)
+        if landmark is not None:
+            if landmark.distance > (self.stop_landmark + self.threshold_range) * 2:
+                return ['move forward'] * 2, "2.2"
+            if landmark.distance > self.stop_landmark + self.threshold_range:
+                return ['move forward'], "2.2"
+            return self.rotate(previous_action), "2.2"
+
+        if self.nearest(detections, self.other_landmarks) is not None:
+            return self.rotate(previous_action), "2.3"
+        return self.rotate(previous_action), "2.4"
+
+    @staticmethod
+    def new_state(curr_state, actions):
+        for action in actions:
+            curr_state = NaviModel.get_next_position(curr_state, action)
+        return curr_state
@@ -7,7 +7,6 @@ import base64
 import threading
 import queue
 from pathlib import Path
-import glob
 
 from PIL import Image
 import cv2
@@ -15,7 +14,8 @@ robot_interface_path = os.path.join(Path(__file__).parent, 'robot_interface/lib/
 sys.path.append(robot_interface_path)
 import robot_interface as sdk
 
-from vision import VisionModel
+from frame_source import CameraFrameSource
+from session_recorder import SessionRecorder, open_replay
 from ai_selector import AiSelector
 from ai_client_base import AiClientBase, ResponseMsg
 import utils
@@ -34,9 +34,13 @@ class Dog:
         self.interrupt_round_flag = threading.Event()
         
         self.capture: cv2.VideoCapture
+        self.frame_source = None  # owns self.capture once the camera is connected
+        self.motion_end_time = 0.0  # time.monotonic() when the last motion command returned
+        self.last_round_seq = 0  # seq of the frame the last search round used
+        self.ready_event = threading.Event()  # set once setup() and the vision warm-up have both finished
+        self.warmup_thread = None
         self.ai_client = AiSelector.getClient(env, apikey[env["ai"]])
         self.ai_client.dog = self  # Give the client a reference to the dog instance
-        self.vision_model = VisionModel(env)
         self.image_files = None  # To store image paths when using test_dataset
         # self.feedback = None
         # self.window = None  # Will be set by the UI
@@ -58,10 +62,9 @@ class Dog:
 
     def signal_handler(self, sig, frame):
         print("SIGINT received, stopping threads and shutting down...")
-        if hasattr(self, 'capture') and self.capture is not None:
-            self.capture.release()
+        self.release_camera()
         cv2.destroyAllWindows()
-        self.ai_client.close()
+        self.ai_client.close()  # also unloads the vision models
         print("All resources released.")
         print("Program exited.")
         
@@ -76,18 +79,53 @@ class Dog:
             self.setup_input_source(None)
             self.target = None  # Initialize target as None
 
+    def start_warmup(self):
+        """Connect the input source and warm up the vision models in the background so the UI comes up immediately."""
+        if self.warmup_thread is None:
+            self.warmup_thread = threading.Thread(target=self.warmup, name="dog-warmup", daemon=True)
+            self.warmup_thread.start()
+
+    def warmup(self):
+        """setup() followed by the vision warm-up; sets ready_event when both are done."""
+        try:
+            self.setup()
+        except Exception as e:
+            print(f"Error setting up input source: {e}")
+        try:
+            print("- Warming up vision models")
+            # Through start_warmup so the model records the thread and never runs a second warm-up
+            self.ai_client.vision_model.start_warmup()
+            self.ai_client.vision_model.wait_until_ready()
+        finally:
+            self.ready_event.set()
+
+    def wait_until_ready(self):
+        """Block until the input source is set up and the vision models are warm."""
+        if not self.ready_event.is_set():
+            print("Waiting for the input source and vision models to finish warming up...")
+        self.ready_event.wait()
+
     def setup_input_source(self, target):
         """
         Setup the input source, either capture from camera or use images from test_dataset.
         """
         print("- Setting up input source")
         if self.env["use_test_dataset"]:
-            # Load images from test_dataset folder
-            image_folder = os.path.join(Path(__file__).parent, f'test_dataset/{target}')
-            self.image_files = sorted(glob.glob(os.path.join(image_folder, "*.jpg")))
-            if not self.image_files:
-                raise FileNotFoundError(f"No images found in folder {image_folder}")
-            print(f"Loaded {len(self.image_files)} images from test_dataset.")
+            # Replay images from test_dataset (or replay_dir) through the same interface as the camera
+            image_folder = self.env.get("replay_dir") or os.path.join(Path(__file__).parent, f'test_dataset/{target}')
+            self.release_camera()
+            size = (self.env["captured_width"], self.env["captured_height"]) if self.env.get("replay_resize", True) else None
+            self.frame_source = open_replay(
+                image_folder,
+                pacing=self.env.get("replay_pacing", "fast"),
+                speed=self.env.get("replay_speed", 1.0),
+                fps=self.env.get("replay_fps", 2.0),
+                size=size,
+                loop=self.env.get("replay_loop", False),
+                prefetch=self.env.get("replay_prefetch", 8),
+            ).start()
+            self.image_files = self.frame_source.paths
+            print(f"Loaded {len(self.image_files)} images from {image_folder}.")
         else:
             self.connect_camera()
 
@@ -95,8 +133,7 @@ class Dog:
         print("- Connecting to camera")
 
         # Ensure any previously opened capture is released
-        if hasattr(self, 'capture') and self.capture is not None:
-            self.capture.release()
+        self.release_camera()
 
         if self.env["connect_robot"]:
             try:
@@ -126,34 +163,69 @@ class Dog:
             print("3) No compatible camera found")
             return False
         
+        # From here on only the grabber thread reads from the capture
+        self.frame_source = CameraFrameSource(self.capture)
+        if self.env.get("record_session", False):
+            self.frame_source.recorder = SessionRecorder.from_env(self.env, state_provider=lambda: self.ai_client.curr_state).start()
+        self.frame_source.start()
         return True
 
-    def read_frame(self):
-        if not hasattr(self, 'capture') or self.capture is None:
+    def release_camera(self):
+        if self.frame_source is not None:
+            self.frame_source.stop()  # joins the grabber/replay thread, then releases the capture
+            if self.frame_source.recorder is not None:
+                self.frame_source.recorder.stop()
+            self.frame_source = None
+        elif hasattr(self, 'capture') and self.capture is not None:
+            self.capture.release()
+        self.capture = None
+
+    def next_captured_frame(self, after_seq=None, timeout=None):
+        """The next Frame (with seq and timestamp) after `after_seq`, or None if there is no camera or on timeout."""
+        if self.frame_source is None:
+            return None
+        # Only watching: the UI feed must not advance a consumer-paced replay
+        return self.frame_source.next_frame(after_seq, timeout, demand=False)
+
+    def read_frame(self, timeout=1.0):
+        """The newest camera Frame (shared, read-only); waits up to `timeout` seconds for the first one."""
+        if self.frame_source is None:
             print("Error: Camera not initialized")
             return None
 
         try:
-            if self.env["use_test_dataset"]:
-                # Use test dataset logic here
-                return None
-            
-            max_retries = 3
-            for attempt in range(max_retries):
-                ret, frame = self.capture.read()
-                if ret and frame is not None:
-                    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            
-                print(f"Frame capture failed, attempt {attempt + 1}/{max_retries}")
-                time.sleep(0.1)  # Short delay between retries
-            
-            print("Failed to capture frame after multiple attempts")
-            return None
+            frame = self.frame_source.latest() or self.frame_source.next_frame(timeout=timeout)
+            if frame is None:
+                print("Failed to capture frame")
+            return frame
         
         except Exception as e:
             print(f"Error reading frame: {e}")
             return None
 
+    def read_fresh_frame(self):
+        """
+        The first frame captured after the last motion ended plus frame_settle_delay, so a round never
+        reasons about a view buffered before or during the motion. With frame_burst > 1 the sharpest
+        (highest Laplacian variance) of that many consecutive frames is used.
+        """
+        if self.frame_source is None:
+            return self.read_frame()
+
+        if not self.frame_source.live:
+            # Replayed frames have no motion to settle after: take the first frame no round has used yet
+            frame = self.frame_source.next_frame(self.last_round_seq, self.env.get("fresh_frame_timeout", 2.0))
+            if frame is not None:
+                self.last_round_seq = frame.seq
+            return frame
+
+        not_before = self.motion_end_time + self.env.get("frame_settle_delay", 0.3)
+        frame = self.frame_source.frame_after(not_before, self.env.get("frame_burst", 1), self.env.get("fresh_frame_timeout", 2.0))
+        if frame is None:
+            print("No frame captured after the last motion; using the latest frame")
+            return self.read_frame()
+        return frame
+
     def shutdown(self, force=False):
         self.robot_auto_thread.join()
         self.feedback_thread.join()
@@ -161,10 +233,9 @@ class Dog:
 
         # Release resources
         # Close camera if capture exists
-        if hasattr(self, 'capture') and self.capture is not None:
-            self.capture.release()
+        self.release_camera()
         cv2.destroyAllWindows()
-        self.ai_client.close()
+        self.ai_client.close()  # also unloads the vision models
         print("All resources released.")
         print("Program exited.")
 
@@ -186,10 +257,17 @@ class Dog:
     def queryGPT_by_LLM(self):
         if self.env["woz"]:
             self.env["max_round"] = 1
+        self.wait_until_ready()
         while self.ai_client.round_number <= self.env["max_round"]:
             self.feedback_complete_event.wait()
 
-            frame = self.read_frame()
+            frame = self.read_fresh_frame()
+            if frame is None:
+                if self.frame_source is None or not self.frame_source.running:
+                    print("Input source finished or unavailable; ending the session.")
+                    break
+                print("No fresh frame; retrying the round.")
+                continue
             print(f"Starting round #{self.ai_client.round_number}")
 
             if self.check_feedback_and_interruption():
@@ -212,7 +290,7 @@ class Dog:
                 if self.env["interactive"] or self.env["vn"]:
                     pass
                 
-                self.activate_sportclient(assistant.action)
+                self.move(assistant.action)
 
                 if formatted_action == 'stop':
                     end_message = "I found the apple, so I'm stopping here. You can now end the chat."
@@ -265,6 +343,14 @@ class Dog:
             self.sport_client.StopMove()
             time.sleep(dt)
 
+    def move(self, actions):
+        """Run the actions and record when the motion ended, for read_fresh_frame."""
+        try:
+            self.activate_sportclient(actions)
+        finally:
+            # Frames captured before this moment may show the view from before or during the motion
+            self.motion_end_time = time.monotonic()
+
     def activate_sportclient(self, actions):
         if not self.env["connect_robot"]:
             print("Assumed action executed.")
@@ -0,0 +1,87 @@
+# round_memory.py
+from collections import deque
+
+
+def token_counter(model):
+    """
+    Counts prompt tokens locally: tiktoken's encoding for `model` when tiktoken is installed,
+    otherwise the usual estimate of four characters per token.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return lambda text: (len(text) + 3) // 4
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("o200k_base")
+    return lambda text: len(encoding.encode(text))
+
+
+class RoundMemory:
+    """
+    The 'Memory' section of the prompts, bounded by a token budget.
+
+    The last `window` rounds are kept verbatim. Older rounds are compacted into one trace line each
+    (state, action, new state, what was seen). When the section exceeds `token_budget`, the oldest
+    verbatim rounds are compacted first, then the oldest trace lines are dropped; the newest round is
+    always kept.
+    """
+    def __init__(self, counter, window=3, token_budget=1500, max_rounds=50):
+        self.count_tokens = counter
+        self.window = window
+        self.token_budget = token_budget
+        self.rounds = deque(maxlen=max_rounds)
+        self.last_tokens = 0
+
+    @classmethod
+    def from_env(cls, env):
+        return cls(
+            token_counter(env['ai_model']),
+            window=env.get('memory_window', 3),
+            token_budget=env.get('memory_token_budget', 1500),
+            max_rounds=env.get('memory_max_rounds', 50),
+        )
+
+    def add(self, round):
+        self.rounds.append(round)
+
+    @staticmethod
+    def trace(round):
+        assistant = round.assistant
+        line = f"Round {round.round_number}: {assistant.initial_state} -> {', '.join(assistant.action)} -> {assistant.new_state}"
+        if round.detected_objects:
+            seen = ", ".join(f"{label} {distance} m" for label, distance in zip(round.detected_objects, round.distances))
+            line += f"; saw {seen}"
+        return line
+
+    def format(self, traces, verbatim):
+        sections = []
+        if traces:
+            sections.append("Earlier rounds:\n" + "\n".join(traces))
+        if verbatim:
+            sections.append("Recent rounds:\n" + "\n".join(repr(round) for round in verbatim))
+        return "\n".join(sections)
+
+    def render(self):
+        rounds = list(self.rounds)
+        split = max(len(rounds) - self.window, 0)
+        traces = [self.trace(round) for round in rounds[:split]]
+        verbatim = rounds[split:]
+
+        text = self.format(traces, verbatim)
+        tokens = self.count_tokens(text)
+        while tokens > self.token_budget:
+            if len(verbatim) > 1:
+                traces.append(self.trace(verbatim.pop(0)))
+            elif traces:
+                traces.pop(0)
+            else:
+                break
+            text = self.format(traces, verbatim)
+            tokens = self.count_tokens(text)
+        self.last_tokens = tokens
+        return text
+
+    def clear(self):
+        self.rounds.clear()
@@ -0,0 +1,211 @@
+# session_recorder.py
+"""
+Records what the camera pipeline delivered so field problems can be replayed offline.
+
+A session directory holds meta.json, index.jsonl (one line per recorded frame: seq, seconds since the
+start of the session, wall-clock time, robot state and where the frame is stored) and either
+segmented video files (record_mode: video) or one JPEG per frame (record_mode: frames).
+
+    record_session: true              # in env.yml, while running on the robot
+    replay_dir: sessions/session_...  # with use_test_dataset: true, replays it as the camera
+"""
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from frame_source import ReplayFrameSource
+
+
+class SessionRecorder:
+    """
+    Writes published frames from a background thread.
+
+    submit() only enqueues a reference to the (immutable) frame, so the capture thread is never held up
+    by encoding or disk I/O; when the writer falls behind, frames are dropped and counted instead.
+    """
+    MODES = ("video", "frames")
+
+    def __init__(self, directory, mode="video", segment_seconds=60, fps=15, fourcc="mp4v", jpeg_quality=90, queue_size=64, state_provider=None, meta=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown record_mode {mode}; choose one of {', '.join(self.MODES)}")
+        self.directory = directory
+        self.mode = mode
+        self.segment_seconds = segment_seconds
+        self.fps = fps
+        self.fourcc = fourcc
+        self.jpeg_quality = jpeg_quality
+        self.state_provider = state_provider  # returns the robot state to store with each frame
+        self.meta = meta or {}
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.recorded = 0
+        self.start_time = None
+        self.writer = None
+        self.segment = None
+        self.segment_start = None
+        self.segment_frames = 0
+        self.index_file = None
+        self.thread = None
+
+    @classmethod
+    def from_env(cls, env, state_provider=None):
+        session = f"session_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
+        directory = os.path.join(env.get("record_dir", "sessions"), session)
+        meta = {
+            "source": env["robot_gstreamer"] if env.get("connect_robot") else "camera 0",
+            "captured_width": env["captured_width"],
+            "captured_height": env["captured_height"],
+        }
+        return cls(
+            directory,
+            mode=env.get("record_mode", "video"),
+            segment_seconds=env.get("record_segment_seconds", 60),
+            fps=env.get("record_fps", 15),
+            queue_size=env.get("record_queue", 64),
+            state_provider=state_provider,
+            meta=meta,
+        )
+
+    def start(self):
+        if self.thread is None:
+            os.makedirs(self.directory, exist_ok=True)
+            if self.mode == "frames":
+                os.makedirs(os.path.join(self.directory, "frames"), exist_ok=True)
+            self.start_time = time.monotonic()
+            with open(os.path.join(self.directory, "meta.json"), "w") as f:
+                json.dump(dict(self.meta, mode=self.mode, started=datetime.datetime.now().isoformat()), f, indent=2)
+            self.index_file = open(os.path.join(self.directory, "index.jsonl"), "w")
+            self.thread = threading.Thread(target=self.run, name="session-recorder", daemon=True)
+            self.thread.start()
+            print(f"Recording session to {self.directory}")
+        return self
+
+    def submit(self, frame):
+        """Called from the capture thread; never blocks."""
+        if self.thread is None:
+            return
+        state = None
+        if self.state_provider is not None:
+            try:
+                state = self.state_provider()
+            except Exception:
+                state = None
+        try:
+            self.frames.put_nowait((frame, state, time.time()))
+        except queue.Full:
+            self.dropped += 1
+
+    def open_segment(self, frame):
+        if self.writer is not None:
+            self.writer.release()
+        number = 0 if self.segment is None else int(self.segment.split("_")[1].split(".")[0]) + 1
+        self.segment = f"segment_{number:03d}.mp4"
+        self.writer = cv2.VideoWriter(
+            os.path.join(self.directory, self.segment), cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (frame.width, frame.height)
+        )
+        self.segment_start = frame.timestamp
+        self.segment_frames = 0
+
+    def write(self, frame, state, wall_time):
+        entry = {
+            "seq": frame.seq,
+            "t": round(frame.timestamp - self.start_time, 4),
+            "wall": round(wall_time, 4),
+            "state": list(state) if isinstance(state, tuple) else state,
+        }
+        if self.mode == "video":
+            if self.writer is None or frame.timestamp - self.segment_start >= self.segment_seconds:
+                self.open_segment(frame)
+            self.writer.write(frame.bgr)
+            entry.update(file=self.segment, index=self.segment_frames)
+            self.segment_frames += 1
+        else:
+            name = os.path.join("frames", f"{frame.seq:06d}.jpg")
+            cv2.imwrite(os.path.join(self.directory, name), frame.bgr, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            entry.update(file=name)
+        self.index_file.write(json.dumps(entry) + "\n")
+        self.recorded += 1
+
+    def run(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            try:
+                self.write(*item)
+            except Exception as e:
+                print(f"Session recorder failed to write frame: {e}")
+
+    def stop(self):
+        """Flush the queued frames and close the files."""
+        if self.thread is None:
+            return
+        self.frames.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+        self.index_file.close()
+        print(f"Recorded {self.recorded} frames to {self.directory} ({self.dropped} dropped)")
+
+
+def is_session(directory):
+    return os.path.exists(os.path.join(directory, "index.jsonl"))
+
+
+def read_index(directory):
+    with open(os.path.join(directory, "index.jsonl")) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class SessionReplaySource(ReplayFrameSource):
+    """
+    Replays a recorded session with its original inter-frame timing (pacing realtime, optionally
+    accelerated with `speed`), or at a fixed rate / as fast as consumed like any other replay.
+    """
+    def __init__(self, directory, **kwargs):
+        self.directory = directory
+        self.entries = read_index(directory)
+        self.states = [entry.get("state") for entry in self.entries]
+        paths = [os.path.join(directory, entry["file"]) for entry in self.entries]
+        kwargs.setdefault("timestamps", [entry["t"] for entry in self.entries])
+        super().__init__(paths, **kwargs)
+
+    def frames(self):
+        capture, segment, position = None, None, 0
+        try:
+            for entry, offset in zip(self.entries, self.timestamps):
+                path = os.path.join(self.directory, entry["file"])
+                if "index" not in entry:
+                    image = self.decode(path)
+                else:
+                    # Video segments are decoded sequentially; the index says which frame of the segment
+                    if path != segment:
+                        if capture is not None:
+                            capture.release()
+                        capture, segment, position = cv2.VideoCapture(path), path, 0
+                    image = None
+                    while position <= entry["index"]:
+                        ret, image = capture.read()
+                        position += 1
+                        if not ret:
+                            image = None
+                            break
+                if image is not None:
+                    yield image, offset
+        finally:
+            if capture is not None:
+                capture.release()
+
+
+def open_replay(directory, **kwargs):
+    """A replay source for a recorded session or for a plain directory of images."""
+    if is_session(directory):
+        return SessionReplaySource(directory, **kwargs)
+    return ReplayFrameSource.from_directory(directory, **kwargs)
@@ -13,6 +13,8 @@ import cv2
 from dataclasses import dataclass
 from ui_config import Colors, Sizes, Styles
 from messages import Messages
+from frame import Frame, as_frame
+from vision import VisionResponse
 from navi_config import NaviConfig
 
 class TTSWorker(QThread):
@@ -166,13 +168,14 @@ class SendMessageThread(QThread):
         elif self.message_data.feedback_mode and self.message_data.awaiting_feedback:
             print("\n=== Processing feedback in UI ===")  # Debug print
             print(f"Feedback text: '{text}'")  # Debug print
+            self.dog.wait_until_ready()
             frame = self.dog.read_frame()
             print(f"Frame received: {frame is not None}")  # Debug print
-            image_bboxes_array, image_detected_objects, image_distances, image_description = self.dog.ai_client.feedback_mode_on(frame)
+            image_analysis, image_detected_objects, image_distances, image_description = self.dog.ai_client.feedback_mode_on(frame)
 
             if self.dog.ai_client.is_instruction_command(text):
                 print("❗ Executing instruction or command")            
-                assistant = self.dog.ai_client.get_response_landmark_or_general_command(text, image_bboxes_array, image_detected_objects, image_distances, image_description)
+                assistant = self.dog.ai_client.get_response_landmark_or_general_command(text, image_analysis, image_detected_objects, image_distances, image_description)
                 print(f"📋 생성된 액션: {assistant.action}")
                 # 확인 과정 없이 바로 액션 실행
                 self.show_loading_signal.emit()
@@ -421,7 +424,7 @@ class RobotDogUI(QMainWindow):
     def _execute_action(self, action):
         """액션을 실행하는 별도의 메서드"""
         print("Executing feedback with actions:", action)
-        self.dog.activate_sportclient(action)
+        self.dog.move(action)
         QTimer.singleShot(3000, self.complete_feedback)
 
     def complete_feedback(self):
@@ -755,16 +758,20 @@ class CameraThread(QThread):
         self.running = True
 
     def run(self):
+        last_seq = 0
         while self.running:
-            frame = self.dog.read_frame()
-            if frame is not None:
-                frame_array = np.array(frame)
-                height, width, channel = frame_array.shape
-                bytes_per_line = 3 * width
-                q_image = QImage(frame_array.data, width, height, bytes_per_line, 
-                               QImage.Format.Format_RGB888)
-                self.frame_update.emit(q_image)
-            self.msleep(30)
+            # Wait for the grabber thread to publish a new frame instead of polling the capture
+            frame = self.dog.next_captured_frame(last_seq, timeout=0.5)
+            if frame is None:
+                self.msleep(30)
+                continue
+            last_seq = frame.seq
+            # Between detector runs the tracker follows the last boxes from frame to frame (vision tracker)
+            tracked = self.dog.ai_client.vision_model.follow_tracks(frame, self.dog.ai_client.curr_state)
+            if tracked is not None:
+                frame = Frame(VisionResponse(frame, [], [], [], *tracked).frame)
+            # copy() detaches the QImage from the frame's buffer before it crosses to the GUI thread
+            self.frame_update.emit(frame.qimage().copy())
 
     def stop(self):
         self.running = False
@@ -802,23 +809,27 @@ class SearchThread(QThread):
             response = original_get_response(*args, **kwargs)
 
             if response:
-                frame = args[0]
-                frame_array = np.array(frame)
-                height, width, channel = frame_array.shape
-                bytes_per_line = 3 * width
-                q_image = QImage(frame_array.data, width, height, bytes_per_line, 
-                                QImage.Format.Format_RGB888)
+                frame = as_frame(args[0])
+                q_image = frame.qimage().copy() if frame is not None else QImage()
                 
                 formatted_action = self.format_actions(response.action)
-                combined_message = f"{response.reason}"
 
-                if self.dog.env["interactive"]:
-                    self.dog.tts_finished_event.clear()
-                    self.status_update.emit(combined_message, q_image)
-                    self.dog.tts_finished_event.wait()
-                
-                if  self.dog.env["woz"] or self.dog.env["vn"]:
-                    self.status_update.emit(combined_message, q_image)
+                if response.reason_future is not None:
+                    # decision_engine: policy; the robot moves now and the reason is shown once the LLM has written it
+                    if self.dog.env["interactive"] or self.dog.env["woz"] or self.dog.env["vn"]:
+                        response.reason_future.add_done_callback(
+                            lambda future: self.status_update.emit(f"{response.reason}", q_image) if response.reason else None
+                        )
+                else:
+                    combined_message = f"{response.reason}"
+
+                    if self.dog.env["interactive"]:
+                        self.dog.tts_finished_event.clear()
+                        self.status_update.emit(combined_message, q_image)
+                        self.dog.tts_finished_event.wait()
+                    
+                    if  self.dog.env["woz"] or self.dog.env["vn"]:
+                        self.status_update.emit(combined_message, q_image)
 
                 if self.dog.env["woz"] or formatted_action == 'stop':
                     end_message = Messages.SEARCH_COMPLETE.format("apple")
@@ -1,4 +1,5 @@
 import sys
+import functools
 import signal
 import textwrap
 from PIL import Image, ImageDraw, ImageFont
@@ -6,6 +7,8 @@ import cv2
 import numpy as np
 import ast
 
+from frame import Frame
+
 def alarm_handler(signum, frame):
     raise TimeoutError
 
@@ -27,6 +30,23 @@ def timeoutInput(timeout):
             signal.alarm(0)
     return s
 
+@functools.lru_cache(maxsize=None)
+def load_font(font_size=40, name="DejaVuSans-Bold.ttf"):
+    """TrueType font shared by every caller; loaded from disk once per size."""
+    try:
+        return ImageFont.truetype(name, font_size)
+    except IOError:
+        return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=32)
+def text_mask(text, font_size=40):
+    """Rendered text as a uint8 alpha mask (H x W), cached per text and size."""
+    font = load_font(font_size)
+    left, top, right, bottom = font.getbbox(text)
+    mask = Image.new("L", (max(1, right), max(1, bottom)), 0)
+    ImageDraw.Draw(mask).text((0, 0), text, fill=255, font=font)
+    return np.asarray(mask)
+
 def put_text_middle(image, text, width, height, font_size=40):
     """
     Function to create an image and place the given text in the middle.
@@ -43,11 +63,8 @@ def put_text_middle(image, text, width, height, font_size=40):
     # Create a new image with black background
     draw = ImageDraw.Draw(image)
 
-    # Try to load a larger font, fall back to default if necessary
-    try:
-        font = ImageFont.truetype("DejaVuSans-Bold.ttf", font_size)
-    except IOError:
-        font = ImageFont.load_default()
+    # Shared font, see load_font
+    font = load_font(font_size)
 
     # Get the size of the text for positioning
     text_bbox = draw.textbbox((0, 0), text, font=font)
@@ -66,34 +83,32 @@ def put_text_top_left(image, text, font_size=40):
     """
     Function to place the given text at the top-left corner of an image.
 
+    The text is blended into the array in place, so the frame is neither copied nor converted
+    to PIL and back, and its channel order (BGR from VisionResponse.frame) is left as it is.
+
     Parameters:
-    image (PIL.Image.Image): The image to draw on.
+    image (numpy array): The H x W x 3 image to draw on.
     text (str): The text to display.
     font_size (int): The size of the font for the text.
 
     Returns:
-    PIL.Image.Image: The image with text placed at the top-left corner.
+    numpy array: The same array with text placed at the top-left corner.
     """
-    # Convert numpy array to PIL Image 
-    image_pil = Image.fromarray(image)
-
-    # Create a drawing object for the image
-    draw = ImageDraw.Draw(image_pil)
-
-    # Try to load a larger font, fall back to default if necessary
-    try:
-        font = ImageFont.truetype("DejaVuSans-Bold.ttf", font_size)
-    except IOError:
-        font = ImageFont.load_default()
+    mask = text_mask(text, font_size)
 
     # Define the position for the top-left corner (with a slight margin for readability)
-    position = (10, 10)  # Adjust as needed for margin
+    x, y = 10, 10  # Adjust as needed for margin
+    height = min(mask.shape[0], image.shape[0] - y)
+    width = min(mask.shape[1], image.shape[1] - x)
+    if height <= 0 or width <= 0:
+        return image
 
     # Add the text to the image in white
-    draw.text(position, text, fill="white", font=font)
-    image_array = PIL2OpenCV(image_pil)
+    alpha = mask[:height, :width, None].astype(np.float32) / 255
+    region = image[y:y + height, x:x + width]
+    region[:] = (region * (1 - alpha) + 255 * alpha).astype(np.uint8)
 
-    return image_array
+    return image
 
 def combine_images_vertically(self, image1, image2):
     # Get the dimensions of the images
@@ -152,6 +167,12 @@ def image_text_append(image, image_width, image_height, text):
     return combined_img
 
 def PIL2OpenCV(pil_image): 
+    # Callers draw on the result, so it must be a buffer of its own: one copy of a Frame's BGR buffer,
+    # or one conversion of its RGB buffer (not cached as the Frame's view, which would then be copied again)
+    if isinstance(pil_image, Frame):
+        if "bgr" in pil_image.views:
+            return pil_image.views["bgr"].copy()
+        return cv2.cvtColor(pil_image.views["rgb"], cv2.COLOR_RGB2BGR)
     numpy_image= np.array(pil_image)
     opencv_image = cv2.cvtColor(numpy_image, cv2.COLOR_RGB2BGR)
     return opencv_image # NumPy array
@@ -161,6 +182,16 @@ def OpenCV2PIL(opencv_image):
     pil_image = Image.fromarray(color_coverted)
     return pil_image
 
+def label_list(candidate_labels):
+    """Candidate labels as a list, accepting the comma separated string form used in env.yml (e.g. "apple.")."""
+    if isinstance(candidate_labels, str):
+        return [label.strip() for label in candidate_labels.split(",") if label.strip()]
+    return list(candidate_labels)
+
+def normalize_label(label):
+    """Detector label or env object name in a comparable form: "Apple." and "apple" are the same object."""
+    return label.strip().strip(".").lower()
+
 def string_to_list(action: str):
     """
     Converts a string action into a list of actions.
@@ -1,41 +1,515 @@
 # vision.py
 import math
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
+from collections import defaultdict, OrderedDict
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import datetime
+from fractions import Fraction
+import threading
+import time
 import warnings
 import os
 
 import cv2
 import torch
-from transformers import pipeline
+from transformers import pipeline, Owlv2ForObjectDetection, Owlv2Processor
 from torchvision.ops import nms
 from PIL import Image, ImageDraw
 import numpy as np
 
 import utils
+from frame import Frame, as_frame
+from model_registry import ModelRegistry
 
 # Conditional import of LangSAM based on env configuration
 def import_langsam():
     from lang_sam import LangSAM
     return LangSAM
 
+# ONNX Runtime is only needed when detection_runtime/depth_runtime is "onnx"
+def import_onnx_backend():
+    import onnx_backend
+    return onnx_backend
+
+class LRUCache:
+    """Small least-recently-used cache with hit/miss counters."""
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+@dataclass
+class DepthBackend:
+    """A depth-estimation checkpoint and the default calibration that turns its raw output into meters."""
+    checkpoint: str
+    metric: bool  # True: predicted depth is in meters; False: relative inverse depth (larger is closer)
+    calibration: dict
+
+# Select with depth_backend in env.yml; override the calibration per backend with depth_calibration
+DEPTH_BACKENDS = {
+    "zoedepth": DepthBackend("Intel/zoedepth-nyu-kitti", True, {"threshold": 3, "scale_under": 0.5, "scale_over": 0.75}),
+    "depth_anything_metric_indoor_small": DepthBackend("depth-anything/Depth-Anything-V2-Metric-Indoor-Small-hf", True, {"threshold": 3, "scale_under": 1.0, "scale_over": 1.0}),
+    "depth_anything_small": DepthBackend("depth-anything/Depth-Anything-V2-Small-hf", False, {}),
+    "midas_small": DepthBackend("Intel/dpt-swinv2-tiny-256", False, {}),
+}
+
+class DepthCalibration:
+    """
+    Maps the raw value of a depth backend to meters.
+
+    Metric backends: raw * scale_under up to threshold meters, raw * scale_over beyond it.
+    Relative backends: 1 / (a * raw + b), with a and b fitted from a few tape-measured samples (see fit_inverse).
+    """
+    def __init__(self, metric, threshold=None, scale_under=1.0, scale_over=1.0, a=None, b=0.0):
+        self.metric = metric
+        self.threshold = threshold
+        self.scale_under = float(scale_under)
+        self.scale_over = float(scale_over)
+        self.a = None if a is None else float(a)
+        self.b = float(b)
+
+    @property
+    def calibrated(self):
+        return self.metric or self.a is not None
+
+    @classmethod
+    def from_env(cls, env, backend_name):
+        backend = DEPTH_BACKENDS[backend_name]
+        params = dict(backend.calibration)
+        if backend_name == "zoedepth" and "depth_scale_for_under" in env:
+            # Older env.yml files still carry the ZoeDepth scales as fraction strings
+            params.update(
+                threshold=env.get("depth_threshold", params["threshold"]),
+                scale_under=Fraction(str(env["depth_scale_for_under"])),
+                scale_over=Fraction(str(env["depth_scale_for_over"])),
+            )
+        params.update((env.get("depth_calibration") or {}).get(backend_name) or {})
+        calibration = cls(backend.metric, **params)
+        if not calibration.calibrated:
+            # Raw inverse depth grows as objects get closer; written into prompts as meters it inverts every distance band
+            if not env.get("allow_uncalibrated_depth", False):
+                raise ValueError(
+                    f"Depth backend {backend_name} returns relative depth and needs a depth_calibration (a, b) in env.yml; "
+                    f"set allow_uncalibrated_depth: true only to benchmark it"
+                )
+            print(f"Depth backend {backend_name} has no depth_calibration in env.yml; distances are raw relative depth.")
+        return calibration
+
+    @staticmethod
+    def fit_inverse(raw_values, meters):
+        """Least-squares a, b for a relative backend from raw outputs and the measured distances in meters."""
+        a, b = np.polyfit(np.asarray(raw_values, dtype=float), 1.0 / np.asarray(meters, dtype=float), 1)
+        return {"a": float(a), "b": float(b)}
+
+    def __call__(self, raw):
+        if self.metric:
+            if self.threshold is not None and raw > self.threshold:
+                return raw * self.scale_over
+            return raw * self.scale_under
+        if self.a is None:
+            return raw
+        return 1.0 / max(self.a * raw + self.b, 1e-6)
+
+class GeometricDistanceEstimator:
+    """
+    Pinhole distance from a known object height: Z = fy * H / h, with fy in pixels and h the box height.
+
+    Confidence starts at the detection score and drops for boxes cut off by the frame border,
+    for tiny boxes, and by the size spread of the label's prior (a "desk" varies less than a "snack").
+    """
+    def __init__(self, fy, calibrated_height, size_priors, border_margin=2, min_box_height=12):
+        self.fy = fy
+        self.calibrated_height = calibrated_height
+        self.size_priors = {self.normalize(label): prior for label, prior in size_priors.items()}
+        self.border_margin = border_margin
+        self.min_box_height = min_box_height
+
+    @classmethod
+    def from_env(cls, env):
+        intrinsics = env.get("camera_intrinsics") or {}
+        fy = intrinsics.get("fy")
+        if not fy:
+            # Focal length from the vertical field of view when the camera is not calibrated
+            fy = (env["captured_height"] / 2) / math.tan(math.radians(env.get("camera_vertical_fov", 60)) / 2)
+        return cls(fy, env["captured_height"], env.get("object_size_priors") or {})
+
+    @staticmethod
+    def normalize(label):
+        return utils.normalize_label(label)
+
+    def prior(self, label):
+        label = self.normalize(label)
+        if label in self.size_priors:
+            return self.size_priors[label]
+        # Detector phrases can carry extra words, e.g. "red apple"
+        for name, prior in self.size_priors.items():
+            if name in label.split():
+                return prior
+        return None
+
+    def estimate(self, label, box, score, frame_size):
+        """Returns (distance in meters or None, confidence in [0, 1])."""
+        prior = self.prior(label)
+        x1, y1, x2, y2 = box
+        box_height = y2 - y1
+        if prior is None or box_height <= 0:
+            return None, 0.0
+
+        frame_width, frame_height = frame_size
+        # fy is given for captured_height; test images may have another resolution
+        fy = self.fy * frame_height / self.calibrated_height
+        distance = fy * prior["height"] / box_height
+
+        confidence = float(score) * (1.0 - prior.get("spread", 0.2))
+        if y1 <= self.border_margin or y2 >= frame_height - 1 - self.border_margin:
+            # The visible part is shorter than the object, so the distance would be overestimated
+            confidence *= 0.3
+        if x1 <= self.border_margin or x2 >= frame_width - 1 - self.border_margin:
+            confidence *= 0.8
+        if box_height < self.min_box_height:
+            confidence *= box_height / self.min_box_height
+        return distance, confidence
+
+def owlv2_detections(processor, logits, pred_boxes, labels, image_size, threshold, device="cpu"):
+    """OWLv2 logits and boxes as the list of dicts the zero-shot-object-detection pipeline returns."""
+    # OWLv2 pads the image to a square, so boxes are relative to the longer side
+    size = max(image_size)
+    results = processor.post_process_object_detection(
+        outputs=SimpleNamespace(logits=logits, pred_boxes=pred_boxes),
+        threshold=threshold,
+        target_sizes=torch.tensor([[size, size]], device=device),
+    )[0]
+    return [
+        {
+            "score": score.item(),
+            "label": labels[label],
+            "box": dict(zip(["xmin", "ymin", "xmax", "ymax"], [int(v) for v in box.tolist()])),
+        }
+        for score, label, box in zip(results["scores"], results["labels"], results["boxes"])
+    ]
+
+class Owlv2Detector:
+    """
+    OWLv2 zero-shot detector that encodes the text queries once per label set.
+
+    The candidate labels do not change during a session, so the text tower runs on the first frame
+    and the query embeddings are reused from an LRU keyed by the label tuple; every later frame only
+    runs the image tower and the box/class heads. Returns the same list of dicts as the
+    zero-shot-object-detection pipeline.
+    """
+    def __init__(self, checkpoint, device, dtype, threshold=0.1, cache_size=8):
+        self.device = device
+        self.dtype = dtype
+        self.threshold = threshold
+        self.processor = Owlv2Processor.from_pretrained(checkpoint)
+        self.model = Owlv2ForObjectDetection.from_pretrained(checkpoint, torch_dtype=dtype).to(device).eval()
+        self.query_cache = LRUCache(cache_size)
+
+    def query_embeddings(self, labels):
+        key = tuple(labels)
+        cached = self.query_cache.get(key)
+        if cached is None:
+            text_inputs = self.processor(text=[labels], return_tensors="pt").to(self.device)
+            with torch.inference_mode():
+                query_embeds = self.model.owlv2.get_text_features(input_ids=text_inputs["input_ids"], attention_mask=text_inputs["attention_mask"])
+            # Same reshaping as Owlv2ForObjectDetection.forward for a batch of one image
+            query_embeds = query_embeds.reshape(1, len(labels), query_embeds.shape[-1])
+            query_mask = text_inputs["input_ids"].reshape(1, len(labels), -1)[..., 0] > 0
+            cached = (query_embeds, query_mask)
+            self.query_cache.put(key, cached)
+        return cached
+
+    def __call__(self, image_pil, candidate_labels):
+        labels = utils.label_list(candidate_labels)
+        query_embeds, query_mask = self.query_embeddings(labels)
+        pixel_values = self.processor(images=image_pil, return_tensors="pt")["pixel_values"].to(self.device, self.dtype)
+
+        with torch.inference_mode():
+            feature_map = self.model.image_embedder(pixel_values=pixel_values)[0]
+            batch_size, height, width, hidden_dim = feature_map.shape
+            image_feats = feature_map.reshape(batch_size, height * width, hidden_dim)
+            logits, _ = self.model.class_predictor(image_feats, query_embeds, query_mask)
+            pred_boxes = self.model.box_predictor(image_feats, feature_map)
+
+        return owlv2_detections(self.processor, logits.float(), pred_boxes.float(), labels, image_pil.size, self.threshold, self.device)
+
+class CachedTextEncoder(torch.nn.Module):
+    """
+    Wraps GroundingDINO's BERT text encoder so an unchanged prompt is encoded once.
+
+    GroundingDINO tokenizes the caption inside its forward pass, so the cache is keyed by the token ids,
+    which map one-to-one to the label set.
+    """
+    def __init__(self, encoder, cache):
+        super().__init__()
+        self.encoder = encoder
+        self.cache = cache
+
+    def forward(self, input_ids=None, **kwargs):
+        key = tuple(input_ids.flatten().tolist())
+        output = self.cache.get(key)
+        if output is None:
+            output = self.encoder(input_ids=input_ids, **kwargs)
+            self.cache.put(key, output)
+        return output
+
+def load_langsam(LangSAM, detection_only=False, cache_size=8):
+    if detection_only:
+        # predict_langsam only ever calls predict_dino, so skip LangSAM.__init__ and never build SAM
+        model = LangSAM.__new__(LangSAM)
+        model.sam_type = None
+        model.return_prompts = False
+        model.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model.build_groundingdino()
+    else:
+        model = LangSAM()
+    model.groundingdino.bert = CachedTextEncoder(model.groundingdino.bert, LRUCache(cache_size))
+    return model
+
+class StageTimer:
+    """Wall-clock timings for the stages of a vision round (model loading, detection, depth, ...)."""
+    def __init__(self):
+        self.last = {}
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.last[name] = self.last.get(name, 0.0) + elapsed
+            self.totals[name] += elapsed
+            self.counts[name] += 1
+
+    def reset(self):
+        self.last = {}
+
+    def report(self):
+        return ", ".join(f"{name}: {seconds * 1000:.1f} ms" for name, seconds in self.last.items())
+
+    def summary(self):
+        return {name: {"count": self.counts[name], "mean_ms": self.totals[name] * 1000 / self.counts[name]} for name in self.totals}
+
 @dataclass
 class VisionResponse:
-    frame: "cv2.typing.MatLike"
+    """
+    Result of describe_image. The annotated frame is only rendered when `frame` is first read,
+    so rounds that never store or show the image skip the drawing and the colour conversion.
+    """
+    image: Frame  # the analyzed frame, not modified
     detected_objects: list
     distances: list
     description: list
+    labels: list = field(default_factory=list)
+    boxes: list = field(default_factory=list)
+    scores: list = field(default_factory=list)
+    draw_on_frame: bool = True
+    _frame: "cv2.typing.MatLike" = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def frame(self):
+        """BGR frame with the detection boxes drawn on it (when draw_on_frame), rendered once."""
+        if self._frame is None:
+            self._frame = self.render()
+        return self._frame
+
+    def render(self):
+        # The only copy of the frame: the BGR buffer that is drawn on
+        image_array = utils.PIL2OpenCV(self.image)
+        if self.draw_on_frame:
+            for label, box, score in zip(self.labels, self.boxes, self.scores):
+                x1, y1, x2, y2 = box
+                cv2.rectangle(image_array, (int(x1), int(y1)), (int(x2), int(y2)), (0, 0, 255), 1)
+                org = (int(x1), int(y1) - 10 if y1 - 10 > 10 else int(y1) + 10)
+                cv2.putText(image_array, f"{label}: {score:.1f}", org, cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+        return image_array
+
+class FrameSimilarityCache:
+    """
+    Returns the previous VisionResponse when the new frame is perceptually the same scene.
+
+    Frames are compared by difference hash (dHash): the frame is shrunk to a tiny grayscale grid and
+    each bit records whether a pixel is brighter than its right neighbour. Frames whose hashes differ
+    in at most `max_distance` bits, taken while the robot state is unchanged, count as a hit.
+    """
+    def __init__(self, hash_size=16, max_distance=6):
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+        self.hits = 0
+        self.misses = 0
+        self.last_hash = None
+        self.last_key = None
+        self.last_response = None
+
+    def frame_hash(self, frame):
+        gray = cv2.resize(frame.gray, (self.hash_size + 1, self.hash_size), interpolation=cv2.INTER_AREA)
+        pixels = gray.astype(np.int16)
+        return (pixels[:, 1:] > pixels[:, :-1]).flatten()
+
+    @staticmethod
+    def copy_response(response, image):
+        # Callers (e.g. OpenaiClient.check_and_update_analysis) append to the lists in place.
+        # Only the detections are reused: the response shows (and renders) the frame it is returned for
+        return replace(
+            response, image=image,
+            detected_objects=list(response.detected_objects), distances=list(response.distances), description=list(response.description),
+        )
+
+    def lookup(self, frame, key):
+        """Returns (cached response or None, frame hash to pass to store())."""
+        frame_hash = self.frame_hash(frame)
+        if (
+            self.last_response is not None
+            and key == self.last_key
+            and np.count_nonzero(frame_hash != self.last_hash) <= self.max_distance
+        ):
+            self.hits += 1
+            return self.copy_response(self.last_response, frame), frame_hash
+        self.misses += 1
+        return None, frame_hash
+
+    def store(self, frame_hash, key, response):
+        self.last_hash = frame_hash
+        self.last_key = key
+        self.last_response = self.copy_response(response, response.image)
+
+    def clear(self):
+        self.last_hash = None
+        self.last_key = None
+        self.last_response = None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+class BoxTracker:
+    """
+    Propagates detector boxes between detector runs with sparse Lucas-Kanade optical flow.
+
+    Feature points inside each box are tracked forward and back; points whose forward-backward error is
+    small vote for the box translation and scale (median). A track's confidence is the fraction of points
+    that survived. The detector has to run again when the schedule says so or any track is lost.
+    """
+    def __init__(self, redetect_interval=30, min_confidence=0.6, max_points=30, max_fb_error=1.0):
+        self.redetect_interval = redetect_interval
+        self.min_confidence = min_confidence
+        self.max_points = max_points
+        self.max_fb_error = max_fb_error
+        self.prev_gray = None
+        self.tracks = []  # [label, box, score]
+        self.frames_since_detection = 0
+        self.confidence = 0.0
+        self.state = None  # robot state the tracks were detected in
+
+    def reset(self, gray, labels, boxes, scores, state=None):
+        self.prev_gray = gray
+        self.state = state
+        self.tracks = [[label, list(box), score] for label, box, score in zip(labels, boxes, scores)]
+        self.frames_since_detection = 0
+        self.confidence = 1.0
+
+    def needs_detection(self, state=None):
+        # Without tracks there is nothing to propagate, so a new object can only come from the detector.
+        # After the robot moved (a different state) the view changed too much for optical flow.
+        return not self.tracks or state != self.state or self.frames_since_detection >= self.redetect_interval
+
+    def box_points(self, box):
+        x1, y1, x2, y2 = [int(v) for v in box]
+        mask = np.zeros_like(self.prev_gray)
+        mask[y1:y2 + 1, x1:x2 + 1] = 255
+        points = cv2.goodFeaturesToTrack(self.prev_gray, self.max_points, 0.01, 3, mask=mask)
+        if points is None or len(points) < 4:
+            # Textureless box: fall back to a regular grid
+            xs, ys = np.meshgrid(np.linspace(x1, x2, 5), np.linspace(y1, y2, 5))
+            points = np.stack([xs.ravel(), ys.ravel()], axis=1).reshape(-1, 1, 2)
+        return points.astype(np.float32)
+
+    def update(self, gray):
+        """Move every box into `gray`; returns (labels, boxes, scores), or None (and drops the tracks) if any track is lost."""
+        height, width = gray.shape[:2]
+        confidences = []
+        for track in self.tracks:
+            points = self.box_points(track[1])
+            forward, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None)
+            backward, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.prev_gray, forward, None)
+            fb_error = np.linalg.norm((points - backward).reshape(-1, 2), axis=1)
+            good = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_error < self.max_fb_error)
+            confidences.append(good.sum() / len(points))
+            if good.sum() < 2:
+                self.tracks = []
+                return None
+
+            old, new = points.reshape(-1, 2)[good], forward.reshape(-1, 2)[good]
+            dx, dy = np.median(new - old, axis=0)
+            old_spread = np.linalg.norm(old - old.mean(axis=0), axis=1)
+            new_spread = np.linalg.norm(new - new.mean(axis=0), axis=1)
+            valid = old_spread > 1e-3
+            scale = float(np.median(new_spread[valid] / old_spread[valid])) if valid.any() else 1.0
+
+            x1, y1, x2, y2 = track[1]
+            center_x, center_y = (x1 + x2) / 2 + dx, (y1 + y2) / 2 + dy
+            half_w, half_h = (x2 - x1) / 2 * scale, (y2 - y1) / 2 * scale
+            track[1] = [
+                int(max(0, min(center_x - half_w, width - 1))), int(max(0, min(center_y - half_h, height - 1))),
+                int(max(0, min(center_x + half_w, width - 1))), int(max(0, min(center_y + half_h, height - 1))),
+            ]
+
+        self.confidence = min(confidences) if confidences else 0.0
+        if self.confidence < self.min_confidence:
+            self.tracks = []
+            return None
+        self.prev_gray = gray
+        self.frames_since_detection += 1
+        return [t[0] for t in self.tracks], [list(t[1]) for t in self.tracks], [t[2] for t in self.tracks]
 
 class VisionModel:
-    def __init__(self, env, depth_model_checkpoint="Intel/zoedepth-nyu-kitti"):
+    def __init__(self, env, depth_model_checkpoint=None):
         """
         Args:
-            depth_model_checkpoint
-            - Absolute Depth: Use the checkpoint `"Intel/zoedepth-nyu-kitti"` for models that return depth in real-world units (e.g., meters).
-            - Relative Depth: Use the checkpoint `"depth-anything/Depth-Anything-V2-base-hf"` for models that return normalized relative depth values.
+            depth_model_checkpoint: overrides the checkpoint of the depth_backend selected in env.yml
+            - Absolute Depth: metric backends (e.g., "zoedepth", "depth_anything_metric_indoor_small") return depth in meters.
+            - Relative Depth: relative backends (e.g., "depth_anything_small", "midas_small") return inverse relative depth and need a depth_calibration.
         """
         self.env = env
         self.image_counter = 0
+        self.depth_backend = self.env.get("depth_backend", "zoedepth")
+        if self.depth_backend not in DEPTH_BACKENDS:
+            raise ValueError(f"Unknown depth_backend {self.depth_backend}; choose one of {', '.join(DEPTH_BACKENDS)}")
+        self.depth_model_checkpoint = depth_model_checkpoint or DEPTH_BACKENDS[self.depth_backend].checkpoint
+        if self.env.get("depth_runtime", "torch") == "onnx" and self.env.get("depth_mode", "full") != "full":
+            # The ONNX depth graph is exported for the captured_width x captured_height input only: roi crops
+            # do not fit it and the reduced input size cannot be applied to it
+            raise ValueError(f"depth_mode {self.env['depth_mode']} is not supported with depth_runtime onnx; use depth_mode full")
+        self.depth_calibration = DepthCalibration.from_env(self.env, self.depth_backend)
+        self.geometric_estimator = GeometricDistanceEstimator.from_env(self.env)
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.dtype = torch.float32
+        self.timer = StageTimer()
+        self.acquired = {}  # role -> registry key (name, device, dtype) held by this instance
+        self.load_lock = threading.RLock()
 
         # Initialize LangSAM if enabled in env
         if self.env.get("langsam", False):
@@ -47,30 +521,260 @@ class VisionModel:
         #self.candidate_labels = ["apple"] # "tv", "potted plant", "coffee machine", "block", "table", "person", "chair", "plant", "bottle", "person"
         self.candidate_labels = self.env["target_in_test_dataset"]
 
-        # Depth Estimation pipeline
-        self.depth_pipe = pipeline("depth-estimation", model=depth_model_checkpoint, device="cuda" if torch.cuda.is_available() else "cpu")
+        # Models stay resident once loaded; see load() / unload()
+        self.depth_pipe = None
+        self.detector = None
+        self.langsam_model = None
+
+        # Propagates boxes between detector runs (tracker)
+        self.tracker = BoxTracker(self.env.get("tracker_redetect_interval", 30), self.env.get("tracker_min_confidence", 0.6))
+        self.tracker_lock = threading.Lock()
+
+        # Skips inference on frames that are nearly identical to the previous one (frame_cache)
+        self.frame_cache = FrameSimilarityCache(self.env.get("frame_cache_hash_size", 16), self.env.get("frame_cache_max_distance", 6))
+
+        # Detection and full-frame depth are independent, so they can run side by side (vision_concurrency)
+        self.executor = None
+        self.stage_threads = self.split_cpu_threads()
+
+        # Set once the models are loaded and warmed up; with background_warmup the owner calls start_warmup()
+        self.ready_event = threading.Event()
+        self.warmup_thread = None
+        self.warmup_lock = threading.Lock()
+        if not self.env.get("background_warmup", False):
+            if self.env.get("preload_vision_models", True):
+                self.load()
+            self.ready_event.set()
+
+    def split_cpu_threads(self):
+        """Intra-op thread counts for (detect, depth) when both run at once on CPU; depth gets the larger share."""
+        total = torch.get_num_threads()
+        detect_threads = self.env.get("detect_threads") or max(1, total // 2)
+        depth_threads = self.env.get("depth_threads") or max(1, total - detect_threads)
+        return {"detect": detect_threads, "depth": depth_threads}
+
+    def run_stage(self, name, function, *args):
+        """Run one model in an executor thread, timed, with its share of the CPU threads."""
+        if self.device.type == "cpu":
+            # With the OpenMP backend the intra-op thread count applies to the calling thread
+            torch.set_num_threads(self.stage_threads[name])
+        with torch.inference_mode(), self.timer.stage(name):
+            return function(*args)
+
+    def follow_tracks(self, image, state=None):
+        """
+        Propagate the tracks of the last detector run into a new frame without running the detector.
+        Called for every camera frame (CameraThread) so optical flow only has to bridge one frame at a
+        time; returns (labels, boxes, scores), or None when the detector has to run again.
+        Tracks are only propagated between frames taken in the same robot `state`; any motion re-detects.
+        """
+        if not self.env.get("tracker", False):
+            return None
+        gray = as_frame(image).gray
+        with self.tracker_lock:
+            if self.tracker.needs_detection(state):
+                return None
+            with self.timer.stage("track"):
+                return self.tracker.update(gray)
+
+    def track_objects(self, image, state=None):
+        """Labels, boxes and scores for the frame, running the detector only when the tracks cannot be followed."""
+        frame = as_frame(image)
+        if not self.env.get("tracker", False):
+            return self.detect_objects(frame)
+
+        tracked = self.follow_tracks(frame, state)
+        if tracked is not None:
+            return tracked
+        # Outside tracker_lock so the camera thread is not held up for a whole detector run
+        labels, boxes, scores = self.detect_objects(frame)
+        with self.tracker_lock:
+            self.tracker.reset(frame.gray, labels, boxes, scores, state)
+        return labels, boxes, scores
+
+    def geometric_distances(self, labels, boxes, scores, frame_size):
+        """Distances from known object sizes and the indices of the boxes that still need the depth network."""
+        min_confidence = self.env.get("geometric_min_confidence", 0.5)
+        distances, pending = [], []
+        for i, (label, box, score) in enumerate(zip(labels, boxes, scores)):
+            distance, confidence = self.geometric_estimator.estimate(label, box, score, frame_size)
+            if distance is None or confidence < min_confidence:
+                distance = None
+                pending.append(i)
+            distances.append(distance)
+        return distances, pending
+
+    def detect_and_measure(self, image, state=None):
+        """Labels, boxes, scores and the distance in meters to each box."""
+        frame = as_frame(image)
+        geometric = self.env.get("geometric_distance", False)
+        # With geometric_distance the depth pass depends on the boxes, so it cannot overlap detection
+        concurrent = self.env.get("vision_concurrency", False) and self.env.get("depth_mode", "full") != "roi" and not geometric
+        if not concurrent:
+            with self.timer.stage("detect"):
+                labels, boxes, scores = self.track_objects(frame, state)
+            if geometric:
+                with self.timer.stage("geometry"):
+                    distances, pending = self.geometric_distances(labels, boxes, scores, frame.size)
+            else:
+                distances, pending = [None] * len(boxes), list(range(len(boxes)))
+            # Only boxes without a confident geometric estimate go through the depth network
+            if pending:
+                with self.timer.stage("depth"):
+                    center_depths = self.depth_estimation(frame, [boxes[i] for i in pending])
+                for i, depth in zip(pending, center_depths):
+                    distances[i] = self.depth_calibration(depth)
+            return labels, boxes, scores, distances
+
+        # The full-frame depth pass does not depend on the boxes: submit both and join
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="vision")
+        detect_future = self.executor.submit(self.run_stage, "detect", self.track_objects, frame, state)
+        depth_future = self.executor.submit(self.run_stage, "depth", self.depth_map, frame)
+        labels, boxes, scores = detect_future.result()
+        depth_values = depth_future.result()
+        with self.timer.stage("lookup"):
+            center_depths = self.lookup_depths(depth_values, boxes, frame.size)
+        return labels, boxes, scores, [self.depth_calibration(depth) for depth in center_depths]
+
+    def load(self):
+        """Load the depth pipeline and the configured detector if they are not resident yet."""
+        self.load_depth_model()
+        self.load_detector()
+
+    def acquire_model(self, role, name, loader):
+        """Take a shared reference on a model from the process-wide registry."""
+        with self.timer.stage(f"load_{role}"):
+            model = ModelRegistry.acquire(name, self.device, self.dtype, loader)
+        self.acquired[role] = (name, self.device, self.dtype)
+        return model
+
+    def onnx_model_name(self, checkpoint):
+        return f"{checkpoint}:onnx{'-int8' if self.env.get('onnx_int8', False) else ''}"
+
+    def load_onnx_model(self, role, checkpoint, factory):
+        onnx_backend = import_onnx_backend()
+        path = onnx_backend.onnx_path(self.env.get("onnx_dir", "onnx_models"), checkpoint, self.env.get("onnx_int8", False))
+        model = ModelRegistry.acquire(self.onnx_model_name(checkpoint), "cpu", "onnx", lambda: factory(onnx_backend, path))
+        self.acquired[role] = (self.onnx_model_name(checkpoint), "cpu", "onnx")
+        return model
+
+    def depth_input_size(self, image_processor):
+        """Network input size for depth_mode "reduced": the processor's default size scaled by depth_input_scale."""
+        scale = self.env.get("depth_input_scale", 0.5)
+        multiple = getattr(image_processor, "ensure_multiple_of", 32) or 32
+        size = image_processor.size
+        return {key: max(multiple, int(size[key] * scale) // multiple * multiple) for key in ("height", "width")}
 
-    def predict_langsam(self, image_pil):
+    def build_depth_pipeline(self):
+        depth_pipe = pipeline("depth-estimation", model=self.depth_model_checkpoint, device=self.device, torch_dtype=self.dtype)
+        if self.env.get("depth_mode", "full") == "reduced":
+            # Resizing happens in the image processor, so a smaller target size shrinks the network input
+            depth_pipe.image_processor.size = self.depth_input_size(depth_pipe.image_processor)
+        return depth_pipe
+
+    def load_depth_model(self):
+        with self.load_lock:
+            if self.depth_pipe is None:
+                if self.env.get("depth_runtime", "torch") == "onnx":
+                    with self.timer.stage("load_depth"):
+                        self.depth_pipe = self.load_onnx_model(
+                            "depth", self.depth_model_checkpoint,
+                            lambda backend, path: backend.OnnxDepthEstimator(path, self.depth_model_checkpoint, threads=self.env.get("onnx_threads", 0))
+                        )
+                else:
+                    name = self.depth_model_checkpoint
+                    if self.env.get("depth_mode", "full") == "reduced":
+                        name = f"{name}@{self.env.get('depth_input_scale', 0.5)}x"
+                    self.depth_pipe = self.acquire_model("depth", name, self.build_depth_pipeline)
+            return self.depth_pipe
+
+    def load_detector(self):
+        with self.load_lock:
+            if self.env["detection_model"] == "langsam":
+                if self.LangSAM is not None and self.langsam_model is None:
+                    detection_only = self.env.get("langsam_detection_only", True)
+                    self.langsam_model = self.acquire_model(
+                        "detector", "langsam-dino" if detection_only else "langsam",
+                        lambda: load_langsam(self.LangSAM, detection_only)
+                    )
+                return self.langsam_model
+            elif self.env["detection_model"] == "owlv2":
+                if self.detector is None and self.env.get("detection_runtime", "torch") == "onnx":
+                    with self.timer.stage("load_detector"):
+                        self.detector = self.load_onnx_model(
+                            "detector", "google/owlv2-base-patch16-ensemble",
+                            lambda backend, path: backend.OnnxOwlv2Detector(path, threads=self.env.get("onnx_threads", 0))
+                        )
+                elif self.detector is None:
+                    self.detector = self.acquire_model(
+                        "detector", "google/owlv2-base-patch16-ensemble",
+                        lambda: Owlv2Detector("google/owlv2-base-patch16-ensemble", self.device, self.dtype)
+                    )
+                return self.detector
+            return None
+
+    def warmup(self):
+        """Load every model and run one dummy inference so the first round runs at steady-state speed."""
+        try:
+            self.load()
+            dummy = Image.new("RGB", (self.env["captured_width"], self.env["captured_height"]), "black")
+            with torch.inference_mode():
+                self.detect_objects(dummy)
+                # A black frame has no boxes, so run the depth network directly
+                self.depth_map(dummy)
+            print(f"Vision models warmed up ({self.timer.report()})")
+            if self.env.get("vision_timing", False):
+                # Printed by whichever process holds the models, the vision worker included
+                print(ModelRegistry.report())
+        except Exception as e:
+            # Rounds fall back to lazy loading rather than waiting forever
+            print(f"Vision warm-up failed: {e}")
+        finally:
+            self.timer.reset()
+            self.ready_event.set()
+
+    def start_warmup(self):
+        """Run warmup() in a background thread, at most once; ready_event is set when it finishes."""
+        with self.warmup_lock:
+            if self.warmup_thread is None and not self.ready_event.is_set():
+                self.warmup_thread = threading.Thread(target=self.warmup, name="vision-warmup", daemon=True)
+                self.warmup_thread.start()
+        return self.warmup_thread
+
+    def wait_until_ready(self, timeout=None):
+        # Starts the warm-up if nobody has yet; never a second one
+        self.start_warmup()
+        return self.ready_event.wait(timeout)
+
+    def unload(self):
+        """Release this instance's references; weights are freed once no other consumer holds them."""
+        with self.load_lock:
+            self.depth_pipe = None
+            self.detector = None
+            self.langsam_model = None
+            for name, device, dtype in self.acquired.values():
+                ModelRegistry.release(name, device, dtype)
+            self.acquired.clear()
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+    def predict_langsam(self, frame):
         warnings.filterwarnings("ignore")
 
         # image_pil = Image.fromarray(np.uint8(frame)).convert("RGB")
 
-        model = self.LangSAM()
+        model = self.load_detector()
         # caption = " ".join(self.candidate_labels)  # Join list into a single string
-        boxes_tensor, logits_tensor, phrases = model.predict_dino(image_pil, self.candidate_labels, box_threshold=self.env["box_threshold"], text_threshold=self.env["text_threshold"])
+        boxes_tensor, logits_tensor, phrases = model.predict_dino(frame.pil, self.candidate_labels, box_threshold=self.env["box_threshold"], text_threshold=self.env["text_threshold"])
         boxes = boxes_tensor.tolist()
         logits =logits_tensor.tolist()
         return phrases, boxes, logits
 
-    def predict_owlv2(self, image_pil):
-        torch.cuda.empty_cache()  # Clear the cache before model initialization
-
-        # Initialize the OWL-V2 model for object detection
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.detector = pipeline(model="google/owlv2-base-patch16-ensemble", task="zero-shot-object-detection", device=0 if torch.cuda.is_available() else -1)
-        
-        # Perform object detection using the OWL-V2 model (handled by the pipeline)
-        predictions = self.detector(image_pil, self.candidate_labels)
+    def predict_owlv2(self, frame):
+        # Perform object detection using the OWL-V2 model (text queries are encoded once, see Owlv2Detector)
+        predictions = self.load_detector()(frame.pil, self.candidate_labels)
         
         boxes = []
         scores = []
@@ -107,8 +811,7 @@ class VisionModel:
         filtered_labels = []
 
         # Process the kept indices and clamp the bounding boxes to image dimensions (done on CPU)
-        image_array = utils.PIL2OpenCV(image_pil)
-        height, width = image_array.shape[:2]
+        width, height = frame.size
         for i in keep_indices:
             if scores[i] >= self.env["detect_confidence"]:
                 filtered_labels.append(labels[i])
@@ -128,52 +831,81 @@ class VisionModel:
 
         return filtered_labels, filtered_boxes, filtered_scores
 
-    def detect_objects(self, image_pil):
+    def detect_objects(self, image):
+        frame = as_frame(image)
         if self.env["detection_model"] == "langsam":
             if not self.env.get("langsam", False):
                 print("LangSAM is not enabled in env.yml.")
                 return [], [], []
-            else: labels, boxes, scores = self.predict_langsam(image_pil)
+            else: labels, boxes, scores = self.predict_langsam(frame)
         elif self.env["detection_model"] == "owlv2":
-            labels, boxes, scores = self.predict_owlv2(image_pil)
+            labels, boxes, scores = self.predict_owlv2(frame)
         else:
             print("Detection model is not set in env.yml")
             return [], [], []  # Return empty values if the detection model is not set
 
         return labels, boxes, scores  # Ensure the method returns these values
 
-    def depth_estimation(self, image_pil, boxes):
-        image_array = utils.PIL2OpenCV(image_pil)
+    def depth_map(self, image):
+        """Run the depth network on the whole frame; returns predicted depth as a (1, H, W) tensor."""
+        depth_values = self.load_depth_model()(as_frame(image).pil)["predicted_depth"]
+        if depth_values.ndim == 2:
+            depth_values = depth_values.unsqueeze(0)
+        return depth_values
 
-        # Get depth estimation predictions
-        predictions = self.depth_pipe(image_pil)
-        depth_values_gpu = predictions["predicted_depth"]
+    def lookup_depths(self, depth_values, boxes, frame_size):
+        """Depth at the center pixel of every box, gathered in one tensor op."""
+        if len(boxes) == 0:
+            return []
 
         # Get dimensions of depth map and frame
-        depth_height, depth_width = depth_values_gpu.shape[-2:]
-        frame_height, frame_width = image_array.shape[:2]
+        depth_height, depth_width = depth_values.shape[-2:]
+        frame_width, frame_height = frame_size
 
         # Calculate scaling factors
         scale_x = depth_width / frame_width
         scale_y = depth_height / frame_height
 
-        center_depths = []
-
-        # Calculate the depth for the center pixel of each bounding box
-        for box in boxes:
-            # Calculate center coordinates of the bounding box
-            center_x = int(((box[0] + box[2]) / 2) * scale_x)
-            center_y = int(((box[1] + box[3]) / 2) * scale_y)
+        # Center pixel of each bounding box in depth map coordinates, clamped to the valid range
+        boxes_tensor = torch.tensor(boxes, dtype=torch.float32)
+        center_x = (((boxes_tensor[:, 0] + boxes_tensor[:, 2]) / 2) * scale_x).long().clamp(0, depth_width - 1)
+        center_y = (((boxes_tensor[:, 1] + boxes_tensor[:, 3]) / 2) * scale_y).long().clamp(0, depth_height - 1)
 
-            # Ensure the indices are within valid range
-            center_x = max(0, min(center_x, depth_width - 1))
-            center_y = max(0, min(center_y, depth_height - 1))
+        # Single gather and a single device-to-host copy instead of one .item() per box
+        return depth_values[0, center_y.to(depth_values.device), center_x.to(depth_values.device)].tolist()
 
-            # Get depth value at the center pixel
-            center_depth = depth_values_gpu[0, center_y, center_x].item()
-            center_depths.append(center_depth)
+    def roi_depths(self, frame, boxes):
+        """Run the depth network only on padded crops around each box and read the crop's center pixel."""
+        padding = self.env.get("depth_roi_padding", 0.5)
+        frame_width, frame_height = frame.size
+        depth_pipe = self.load_depth_model()
 
+        center_depths = []
+        for x1, y1, x2, y2 in boxes:
+            pad_x = (x2 - x1) * padding
+            pad_y = (y2 - y1) * padding
+            crop_box = (
+                int(max(0, x1 - pad_x)), int(max(0, y1 - pad_y)),
+                int(min(frame_width, x2 + pad_x)), int(min(frame_height, y2 + pad_y)),
+            )
+            crop = frame.pil.crop(crop_box)
+            depth_values = depth_pipe(crop)["predicted_depth"]
+            if depth_values.ndim == 2:
+                depth_values = depth_values.unsqueeze(0)
+            # The box center in crop coordinates
+            local_box = [x1 - crop_box[0], y1 - crop_box[1], x2 - crop_box[0], y2 - crop_box[1]]
+            center_depths.extend(self.lookup_depths(depth_values, [local_box], crop.size))
         return center_depths
+
+    def depth_estimation(self, image, boxes):
+        # Nothing to measure: skip the depth network entirely
+        if len(boxes) == 0:
+            return []
+
+        frame = as_frame(image)
+        if self.env.get("depth_mode", "full") == "roi":
+            return self.roi_depths(frame, boxes)
+        return self.lookup_depths(self.depth_map(frame), boxes, frame.size)
         
         
         
@@ -221,34 +953,44 @@ class VisionModel:
 
         # return average_depths
 
-    def get_label(self, image_pil):
-        labels, boxes, scores = self.detect_objects(image_pil)
+    def get_label(self, image):
+        labels, boxes, scores = self.detect_objects(image)
         return labels[0]
 
-    def describe_image(self, image_pil, draw_on_frame=True):
-        image_array = utils.PIL2OpenCV(image_pil)
+    def describe_image(self, image, draw_on_frame=True, state=None):
+        """
+        Args:
+            image: a Frame or a PIL RGB image
+            state: the robot state the frame was captured in; a cached response is only reused for the same state.
+        """
+        self.timer.reset()
+        frame = as_frame(image)
+        if self.env.get("frame_cache", False):
+            with self.timer.stage("frame_cache"):
+                cached, frame_hash = self.frame_cache.lookup(frame, (state, draw_on_frame))
+            if cached is not None:
+                if self.env.get("vision_timing", False):
+                    print(f"Vision timing: {self.timer.report()} (cache hit, {self.frame_cache.stats()})")
+                return cached
 
-        # Get detected objects and their bounding boxes
-        labels, boxes, scores = self.detect_objects(image_pil)
-        
-        # Get depth for each bounding box (already using GPU in depth_estimation)
-        center_depths = self.depth_estimation(image_pil, boxes)
+        response = self.analyze_frame(frame, draw_on_frame, state)
+        if self.env.get("frame_cache", False):
+            self.frame_cache.store(frame_hash, (state, draw_on_frame), response)
+        return response
+
+    def analyze_frame(self, frame, draw_on_frame=True, state=None):
+        # Get detected objects, their bounding boxes and the distance in meters to each box
+        labels, boxes, scores, box_distances = self.detect_and_measure(frame, state)
 
         detected_objects = []
         distances = []
         description = []
-        depth_threshold = self.env["depth_threshold"]
 
         # Process each detected object on the CPU (text formatting, logic is more efficient on CPU)
         for i, label in enumerate(labels):
             x1, y1, x2, y2 = boxes[i]
 
-            # Adjust depth using environment thresholds (on CPU)
-            avg_depth = center_depths[i] * (
-                eval(self.env["depth_scale_for_under"]) if center_depths[i] <= depth_threshold
-                else eval(self.env["depth_scale_for_over"])
-            )
-            rounded_depth = round(avg_depth, 1)
+            rounded_depth = round(box_distances[i], 1)
             # Calculate the center of the bounding box (on CPU, simple arithmetic)
             center_x = (x1 + x2) / 2
             center_y = (y1 + y2) / 2
@@ -263,17 +1005,11 @@ class VisionModel:
             else:
                 description.append(f"You detected {label} in the middle of the frame with a distance of {rounded_depth} meters.")
 
-        # Draw bounding boxes and labels on the frame if draw_on_frame is True (done on CPU using OpenCV)
-        if draw_on_frame:
-            for i, box in enumerate(boxes):
-                x1, y1, x2, y2 = box
-                cv2.rectangle(image_array, (int(x1), int(y1)), (int(x2), int(y2)), (0, 0, 255), 1)
-                org = (int(x1), int(y1) - 10 if y1 - 10 > 10 else int(y1) + 10)
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                # cv2.putText(frame, f"{labels[i]}: {average_depths[i]:.1f}m", org, font, 0.5, (0, 0, 255), 1)
-                cv2.putText(image_array, f"{labels[i]}: {scores[i]:.1f}", org, font, 0.5, (0, 0, 255), 1)
+        if self.env.get("vision_timing", False):
+            print(f"Vision timing: {self.timer.report()}" + (f" ({self.frame_cache.stats()})" if self.env.get("frame_cache", False) else ""))
 
-        return VisionResponse(image_array, detected_objects, distances, description)
+        # Boxes are drawn lazily, when the response's frame is first stored or shown
+        return VisionResponse(frame, detected_objects, distances, description, list(labels), list(boxes), list(scores), draw_on_frame)
     
     # def store_image(self, cv2_image = None):
     #     if cv2_image is None:
@@ -0,0 +1,211 @@
+# vision_benchmark.py
+"""
+Latency benchmark for VisionModel over the test_dataset/<target> images used by Dog.setup_input_source.
+
+    python vision_benchmark.py --cpu --detectors owlv2 langsam --depth-modes full reduced roi
+    python vision_benchmark.py --cpu --depth-backends zoedepth depth_anything_metric_indoor_small midas_small
+    python vision_benchmark.py --save-baseline benchmarks/vision_baseline.json
+    python vision_benchmark.py --baseline benchmarks/vision_baseline.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+
+import yaml
+
+DEFAULT_BASELINE = "benchmarks/vision_baseline.json"
+STAGES = ["detect", "depth", "describe", "annotate"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark VisionModel stages on test_dataset images.")
+    parser.add_argument("--env", default="env.yml")
+    parser.add_argument("--cpu", action="store_true", help="hide CUDA devices so the run matches a stock Linux box")
+    parser.add_argument("--detectors", nargs="+", default=None, help="detection models to run (default: detection_model from env.yml)")
+    parser.add_argument("--depth-backends", nargs="+", default=None, help="names from vision.DEPTH_BACKENDS (default: depth_backend from env.yml)")
+    parser.add_argument("--depth-modes", nargs="+", default=None, help="full, reduced, roi (default: depth_mode from env.yml)")
+    parser.add_argument("--limit", type=int, default=None, help="use only the first N images")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the image set per configuration")
+    parser.add_argument("--output", default=None, help="write the JSON report here as well as to stdout")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, default=None)
+    parser.add_argument("--baseline", nargs="?", const=DEFAULT_BASELINE, default=None, help="compare p50/p95 against a saved baseline")
+    return parser.parse_args()
+
+
+def percentiles(samples):
+    import numpy as np
+    if not samples:
+        return {}
+    values = np.array(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+        "n": len(samples),
+    }
+
+
+def rss_mb(rss_bytes):
+    return round(rss_bytes / 2**20, 1)
+
+
+def load_images(env, limit=None):
+    from PIL import Image
+
+    folder = os.path.join(Path(__file__).parent, f"test_dataset/{env['target_in_test_dataset']}")
+    image_files = sorted(glob.glob(os.path.join(folder, "*.jpg")))
+    if not image_files:
+        raise FileNotFoundError(f"No images found in folder {folder}")
+    image_files = image_files[:limit] if limit else image_files
+    return [(os.path.basename(path), Image.open(path).convert("RGB")) for path in image_files]
+
+
+def benchmark_config(env, images, repeat):
+    from model_registry import ModelRegistry, process_rss_bytes
+    from vision import VisionModel
+
+    # Configurations run one after another in this process, so memory is measured against the RSS before
+    # this one (ru_maxrss would be the high-water mark of every earlier configuration as well)
+    rss_before = process_rss_bytes()
+    rss_peak = rss_before
+    start = time.perf_counter()
+    vision_model = VisionModel(env)
+    vision_model.warmup()
+    startup_seconds = time.perf_counter() - start
+
+    samples = {stage: [] for stage in STAGES}
+    depths = {}
+    describe_total = 0.0
+    for _ in range(repeat):
+        for name, image in images:
+            start = time.perf_counter()
+            labels, boxes, scores = vision_model.detect_objects(image)
+            samples["detect"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            depths[name] = vision_model.depth_estimation(image, boxes)
+            samples["depth"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            response = vision_model.describe_image(image, draw_on_frame=True)
+            elapsed = time.perf_counter() - start
+            describe_total += elapsed
+            samples["describe"].append(elapsed)
+
+            # Annotation is rendered lazily on first access to the frame
+            start = time.perf_counter()
+            response.frame
+            samples["annotate"].append(time.perf_counter() - start)
+            rss_peak = max(rss_peak, process_rss_bytes())
+
+    model_memory_mb = round(sum(info["memory_mb"] for info in ModelRegistry.resident()), 1)
+    vision_model.unload()
+    return {
+        "depth_backend": vision_model.depth_backend,
+        "depth_checkpoint": vision_model.depth_model_checkpoint,
+        "startup_s": round(startup_seconds, 2),
+        "stages": {stage: percentiles(values) for stage, values in samples.items()},
+        "throughput_fps": round(len(samples["describe"]) / describe_total, 3) if describe_total else None,
+        "model_memory_mb": model_memory_mb,  # parameters and buffers of the loaded networks
+        "rss_delta_mb": rss_mb(rss_peak - rss_before),  # process RSS growth while this configuration ran
+    }, depths
+
+
+def depth_error(depths, reference):
+    """Mean relative difference of per-box depths against a reference run with the same boxes."""
+    errors = []
+    for name, values in depths.items():
+        ref = reference.get(name, [])
+        if len(values) != len(ref):
+            continue
+        errors.extend(abs(v - r) / max(abs(r), 1e-6) for v, r in zip(values, ref))
+    return round(sum(errors) / len(errors), 4) if errors else None
+
+
+def compare(results, baseline):
+    print("\nChange against baseline (p50 / p95):", file=sys.stderr)
+    for key, result in results["configs"].items():
+        base = baseline.get("configs", {}).get(key)
+        if base is None:
+            print(f"- {key}: not in baseline", file=sys.stderr)
+            continue
+        for stage, stats in result["stages"].items():
+            base_stats = base["stages"].get(stage)
+            if not stats or not base_stats:
+                continue
+            changes = [
+                f"{(stats[p] - base_stats[p]) / base_stats[p]:+.1%}" if base_stats[p] else "n/a"
+                for p in ("p50_ms", "p95_ms")
+            ]
+            print(f"- {key} {stage}: {changes[0]} / {changes[1]}", file=sys.stderr)
+
+
+def main():
+    args = parse_args()
+    # Fail before the models are loaded and timed, not after
+    if args.baseline and not os.path.exists(args.baseline):
+        raise SystemExit(f"Baseline {args.baseline} not found; record one on this machine first with --save-baseline {args.baseline}")
+    if args.cpu:
+        # Must happen before torch is imported by vision.py
+        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+    with open(args.env) as f:
+        env = yaml.safe_load(f)
+
+    # Measure the models themselves: no background threads, caches or trackers
+    env.update({"background_warmup": False, "preload_vision_models": True, "frame_cache": False, "tracker": False, "vision_timing": False})
+    # Latency does not depend on the calibration, so relative backends can be benchmarked before they are calibrated
+    env["allow_uncalibrated_depth"] = True
+    if args.detectors and "langsam" in args.detectors:
+        env["langsam"] = True
+
+    import torch
+
+    images = load_images(env, args.limit)
+    results = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": {"platform": platform.platform(), "cpu_count": os.cpu_count(), "cuda": torch.cuda.is_available(), "torch_threads": torch.get_num_threads()},
+        "images": len(images),
+        "repeat": args.repeat,
+        "configs": {},
+    }
+
+    depth_runs = {}
+    for detector in args.detectors or [env["detection_model"]]:
+        for depth_backend in args.depth_backends or [env.get("depth_backend", "zoedepth")]:
+            for depth_mode in args.depth_modes or [env.get("depth_mode", "full")]:
+                config_env = dict(env, detection_model=detector, depth_backend=depth_backend, depth_mode=depth_mode)
+                key = f"{detector}|{depth_backend}|{depth_mode}"
+                print(f"Benchmarking {key} on {len(images)} images...", file=sys.stderr)
+                results["configs"][key], depth_runs[key] = benchmark_config(config_env, images, args.repeat)
+
+    # Accuracy side of the depth_mode tradeoff: per-box depth against full-frame depth with the same boxes
+    for key, depths in depth_runs.items():
+        detector, depth_backend, depth_mode = key.split("|")
+        reference = depth_runs.get(f"{detector}|{depth_backend}|full")
+        if depth_mode != "full" and reference is not None:
+            results["configs"][key]["depth_rel_error_vs_full"] = depth_error(depths, reference)
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            f.write(report)
+        print(f"Baseline saved to {args.save_baseline}", file=sys.stderr)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# vision_worker.py
+import multiprocessing as mp
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from frame import Frame, as_frame
+from vision import VisionResponse
+
+
+class SharedFrameRing:
+    """
+    Fixed-size frame slots in one shared memory block.
+
+    The parent writes a frame into the next slot and only sends the slot index and shape over the
+    pipe, so pixel data is never pickled.
+    """
+    def __init__(self, slots, height, width, name=None):
+        self.shape = (slots, height, width, 3)
+        size = int(np.prod(self.shape))
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.frames = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf)
+        self.next_slot = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def fits(self, height, width):
+        return height <= self.shape[1] and width <= self.shape[2]
+
+    def write(self, frame):
+        """Copy the RGB view of a Frame into the next slot; returns (slot, height, width)."""
+        array = frame.rgb
+        height, width = array.shape[:2]
+        if not self.fits(height, width):
+            raise ValueError(f"Frame {width}x{height} does not fit the {self.shape[2]}x{self.shape[1]} ring slots")
+        slot = self.next_slot
+        self.next_slot = (self.next_slot + 1) % self.shape[0]
+        self.frames[slot, :height, :width] = array
+        return slot, height, width
+
+    def view(self, slot, height, width):
+        return self.frames[slot, :height, :width]
+
+    def close(self):
+        del self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def worker_main(env, ring_name, ring_shape, conn):
+    """Entry point of the vision process: owns the models and serves requests from the parent."""
+    from vision import VisionModel
+
+    slots, height, width, _ = ring_shape
+    ring = SharedFrameRing(slots, height, width, name=ring_name)
+    try:
+        vision_model = VisionModel(dict(env, background_warmup=False, preload_vision_models=False))
+        vision_model.warmup()
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        ring.close()
+        conn.close()
+        return
+    conn.send(("ready", None))
+
+    while True:
+        request, payload = conn.recv()
+        if request == "close":
+            break
+        if request == "ring":
+            # The parent replaced the ring with larger slots
+            ring.close()
+            ring_name, ring_shape = payload
+            ring = SharedFrameRing(*ring_shape[:3], name=ring_name)
+            conn.send(("ok", None))
+            continue
+        try:
+            slot, frame_height, frame_width, kwargs = payload
+            # Wraps the slot without copying; the parent does not reuse it before the reply
+            frame = Frame(ring.view(slot, frame_height, frame_width), "rgb")
+            if request == "describe_image":
+                response = vision_model.describe_image(frame, **kwargs)
+                # Only the detections go back; the parent renders the annotated frame if it needs it
+                result = (
+                    response.detected_objects, response.distances, response.description,
+                    response.labels, response.boxes, response.scores, response.draw_on_frame,
+                )
+            elif request == "follow_tracks":
+                result = vision_model.follow_tracks(frame, **kwargs)
+            elif request == "detect_objects":
+                result = vision_model.detect_objects(frame)
+            elif request == "depth_estimation":
+                result = vision_model.depth_estimation(frame, **kwargs)
+            else:
+                raise ValueError(f"Unknown request {request}")
+            conn.send(("ok", result))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+    vision_model.unload()
+    ring.close()
+    conn.close()
+
+
+class RemoteVisionModel:
+    """
+    Runs VisionModel in a separate process so inference does not compete for the GIL with the Qt UI
+    and the motion loops. Exposes the same API as VisionModel for OpenaiClient and Dog.
+    """
+    def __init__(self, env):
+        self.env = env
+        self.ring = SharedFrameRing(env.get("vision_worker_slots", 4), env["captured_height"], env["captured_width"])
+        self.conn = None
+        self.process = None
+        self.lock = threading.Lock()
+        self.ready_event = threading.Event()
+        self.warmup_thread = None
+        self.warmup_lock = threading.Lock()
+        self.error = None  # why the worker is unusable, set when it fails to start or dies
+        if not self.env.get("background_warmup", False):
+            self.warmup()
+
+    def start_process(self):
+        # CUDA cannot be re-initialised in a forked child
+        context = mp.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main,
+            args=(self.env, self.ring.name, self.ring.shape, child_conn),
+            name="vision-worker",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def warmup(self):
+        """Start the worker and block until its models are loaded and warmed up."""
+        # The pipe carries one reply per message, so it is only ever read under self.lock
+        with self.lock:
+            if self.ready_event.is_set():
+                return
+            try:
+                if self.process is None:
+                    self.start_process()
+                status, result = self.conn.recv()
+                if status != "ready":
+                    self.error = result
+                print(f"Vision worker process {self.process.pid} is {status}" + (f": {result}" if self.error else ""))
+            except (EOFError, OSError) as e:
+                self.error = f"{type(e).__name__}: {e}"
+                print(f"Vision worker failed to start: {e}")
+            finally:
+                self.ready_event.set()
+
+    def start_warmup(self):
+        """Run warmup() in a background thread, at most once."""
+        with self.warmup_lock:
+            if self.warmup_thread is None and not self.ready_event.is_set():
+                self.warmup_thread = threading.Thread(target=self.warmup, name="vision-warmup", daemon=True)
+                self.warmup_thread.start()
+        return self.warmup_thread
+
+    def wait_until_ready(self, timeout=None):
+        self.start_warmup()
+        return self.ready_event.wait(timeout)
+
+    def request(self, name, image, blocking=True, **kwargs):
+        """Serve one call in the worker; with blocking=False returns None instead of waiting for a call in progress."""
+        self.wait_until_ready()
+        frame = as_frame(image)
+        if not self.lock.acquire(blocking=blocking):
+            return None
+        try:
+            self.check_alive()
+            if not self.ring.fits(frame.height, frame.width):
+                self.grow_ring(frame.height, frame.width)
+            slot, height, width = self.ring.write(frame)
+            self.conn.send((name, (slot, height, width, kwargs)))
+            status, result = self.conn.recv()
+        except (EOFError, OSError) as e:
+            # BrokenPipeError is an OSError: the worker died while serving the request
+            self.error = f"{type(e).__name__}: {e}"
+            raise RuntimeError(f"Vision worker died during {name}: {self.error}") from e
+        finally:
+            self.lock.release()
+        if status != "ok":
+            raise RuntimeError(f"Vision worker {name} failed: {result}")
+        if name == "describe_image":
+            return VisionResponse(frame, *result)
+        return result
+
+    def describe_image(self, image, draw_on_frame=True, state=None):
+        return self.request("describe_image", image, draw_on_frame=draw_on_frame, state=state)
+
+    def grow_ring(self, height, width):
+        """
+        Replace the ring with slots large enough for a frame bigger than captured_width x captured_height
+        (e.g. a replay with replay_resize: false). Called under self.lock.
+        """
+        ring = SharedFrameRing(self.ring.shape[0], max(height, self.ring.shape[1]), max(width, self.ring.shape[2]))
+        try:
+            self.conn.send(("ring", (ring.name, ring.shape)))
+            self.conn.recv()
+        except (EOFError, OSError):
+            ring.close()
+            raise
+        self.ring.close()
+        self.ring = ring
+
+    def check_alive(self):
+        if self.error is not None:
+            raise RuntimeError(f"Vision worker is not running: {self.error}")
+        if self.process is None or not self.process.is_alive():
+            exitcode = self.process.exitcode if self.process is not None else None
+            self.error = f"process exited with code {exitcode}"
+            raise RuntimeError(f"Vision worker is not running: {self.error}")
+
+    def follow_tracks(self, image, state=None):
+        # Called for every camera frame: skip it rather than wait for the warm-up or a detection in progress
+        if not self.ready_event.is_set() or self.error is not None:
+            return None
+        return self.request("follow_tracks", image, blocking=False, state=state)
+
+    def detect_objects(self, image):
+        return self.request("detect_objects", image)
+
+    def depth_estimation(self, image, boxes):
+        return self.request("depth_estimation", image, boxes=boxes)
+
+    def unload(self):
+        """Stop the worker process and release the shared memory (safe to call more than once)."""
+        if self.process is not None:
+            try:
+                with self.lock:
+                    self.conn.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None